@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Hashable
+
+# Admission control for proof of work submissions, when a block is found every miner submits at once
+# Submissions are checked one at a time as only one can win, and only a bounded amount of them may wait to be checked
+
+
+class SubmissionQueue:
+    """Class represents the submissions waiting to be checked, submissions past max_size are turned away"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.size_lock = threading.Lock()
+        self.check_lock = threading.Lock()  # held by the submission being checked
+
+    @contextmanager
+    def admit(self):
+        # Function waits for the submission's turn to be checked, gives False if the queue is full
+        with self.size_lock:
+            admitted = self.size < self.max_size
+            if admitted:
+                self.size += 1
+
+        if not admitted:
+            yield False
+            return
+
+        try:
+            with self.check_lock:
+                yield True
+        finally:
+            with self.size_lock:
+                self.size -= 1
+
+
+class RecentSubmissions:
+    """Class represents the most recent submissions, used to turn away the same submission being sent again"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.submissions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, submission: Hashable) -> bool:
+        # Function adds a submission, returns False if it was already submitted recently
+        with self.lock:
+            if submission in self.submissions:
+                self.submissions.move_to_end(submission)
+                return False
+            self.submissions[submission] = None
+            if len(self.submissions) > self.max_size:
+                self.submissions.popitem(last=False)
+            return True
+
+    def remove(self, submission: Hashable) -> None:
+        # Function forgets a submission, so it can be submitted again
+        with self.lock:
+            self.submissions.pop(submission, None)
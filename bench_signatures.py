@@ -0,0 +1,58 @@
+import argparse
+import json
+import time
+import uuid
+from typing import Callable
+
+import signatures
+from blockchain import Transaction, Wallet
+
+# Benchmark of the signature schemes, comparing how fast transactions are signed and verified with each and how large
+# their keys, signatures and transaction payloads (as sent to POST /api/transaction) are
+
+
+def throughput(function: Callable, amount: int) -> float:
+    # Function calls function amount times, returns the calls per second
+    start = time.perf_counter()
+    for i in range(amount):
+        function(i)
+    return amount / (time.perf_counter() - start)
+
+
+def bench_scheme(scheme: signatures.SignatureScheme, operations: int) -> dict:
+    sender, recipient = Wallet(scheme=scheme), Wallet(scheme=scheme)
+    transactions = [Transaction(sender.public_key, sender.private_key, recipient.public_key, 1 + i, uuid.uuid4())
+                    for i in range(operations)]
+    messages = [str(transaction).encode("ascii") for transaction in transactions]
+
+    keygen_rate = throughput(lambda i: scheme.generate_private_key(), max(operations // 10, 1))
+    sign_rate = throughput(lambda i: transactions[i].sign(), operations)
+    verify_rate = throughput(lambda i: signatures.verify(sender.public_key, transactions[i].signature, messages[i]),
+                             operations)
+
+    payload = transactions[0].to_ascii_dict(include_signature=True)
+    return {
+        "scheme": scheme.name,
+        "keygen/s": keygen_rate,
+        "sign/s": sign_rate,
+        "verify/s": verify_rate,
+        "public key B": len(signatures.public_key_to_bytes(sender.public_key)),
+        "signature B": len(transactions[0].signature),
+        "payload B": len(json.dumps(payload))
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the signature schemes")
+    parser.add_argument("--operations", type=int, default=2000, help="transactions signed and verified per scheme")
+    args = parser.parse_args()
+
+    results = [bench_scheme(scheme, args.operations) for scheme in signatures.schemes.values()]
+    columns = list(results[0])
+    print("".join(f"{column:>14}" for column in columns))
+    for result in results:
+        print("".join(f"{value:>14.0f}" if isinstance(value, float) else f"{value:>14}" for value in result.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from typing import List, Tuple
+
+# Benchmark of a node's cold start, each run is a new interpreter that imports coinbase and creates the app, then
+# makes the first request, which sets up the database and the coinbase. Runs are made against a new database and
+# against one that is already set up, e.g. a worker being restarted
+
+startup_script = """
+import time
+start = time.perf_counter()
+import coinbase
+app = coinbase.create_app({database_uri!r}, crypto_workers=0)
+created = time.perf_counter()
+app.test_client().get("/api/coinbase")
+print(created - start, time.perf_counter() - created)
+"""
+
+
+def cold_start(database_uri: str) -> Tuple[float, float]:
+    # Function starts a node in a new interpreter, returns the seconds taken to create the app and for the first request
+    script = startup_script.format(database_uri=database_uri)
+    output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            check=True, capture_output=True, text=True).stdout
+    create_seconds, first_request_seconds = output.split()
+    return float(create_seconds), float(first_request_seconds)
+
+
+def report(name: str, timings: List[Tuple[float, float]]) -> None:
+    create_median = statistics.median(create for create, _ in timings)
+    first_request_median = statistics.median(first_request for _, first_request in timings)
+    print(f"{name:<20}{create_median * 1000:>14.1f}{first_request_median * 1000:>20.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the cold start of a node")
+    parser.add_argument("--runs", type=int, default=5, help="interpreters started per case")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        new_timings = []
+        for run in range(args.runs):
+            new_timings.append(cold_start(f"sqlite:///{os.path.join(directory, f'new-{run}.sqlite3')}"))
+
+        existing_uri = f"sqlite:///{os.path.join(directory, 'existing.sqlite3')}"
+        cold_start(existing_uri)
+        existing_timings = [cold_start(existing_uri) for _ in range(args.runs)]
+
+    print(f"{'database':<20}{'create_app ms':>14}{'first request ms':>20}")
+    report("new", new_timings)
+    report("existing", existing_timings)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,19 +2,19 @@ import base64
 import binascii
 import uuid
 import hashlib
+import time
 
-from sqlalchemy import func
+from abc import ABC, ABCMeta, abstractmethod
+from collections import defaultdict
+from sqlalchemy import and_, func, inspect, or_, select, type_coerce, types
 
 import dbmodels as dbmodels
+import signatures
 
 from uuid import UUID
 from flask_sqlalchemy import SQLAlchemy
-from typing import List, Tuple, Union
-from cryptography.exceptions import InvalidSignature
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding, rsa
-from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, PublicFormat, NoEncryption
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
+from typing import Iterator, List, Tuple, Union
+from signatures import BatchVerifier, PrivateKey, PublicKey, SignatureScheme, Signer, Verifier
 
 db = SQLAlchemy()
 
@@ -24,8 +24,54 @@ num_of_zeros = 4
 # The reward for mining a block
 block_mining_reward = 20
 
+# The uuid of the genesis block, which is the same on every node
+genesis_block_uuid = UUID("00000000-0000-4000-8000-000000000000")
 
-class Transaction(db.Model):
+
+class FormatModelMeta(ABCMeta, type(db.Model)):
+    """Class represents the metaclass of models sharing an abstract format with their read model"""
+
+
+class TransactionFormat(ABC):
+    """
+        Class represents the serialization and hashing of a transaction, shared by Transaction and its read model
+        Subclasses have uuid, amount and signature attributes
+    """
+
+    __slots__ = ()
+
+    @abstractmethod
+    def ascii_keys(self) -> Tuple[str, str]:
+        # Function returns the (sender's, recipient's) public keys in ascii
+        pass
+
+    def to_ascii_dict(self, include_signature=False) -> dict:
+        # Similarly, function returns an ascii dictionary of this transaction, without the private key
+        # signatures should only be included if the transaction has already been placed in a block
+
+        sender_public_key, recipient_public_key = self.ascii_keys()
+        ret = {
+            "sender_public_key": sender_public_key,
+            "recipient_public_key": recipient_public_key,
+            "amount": self.amount,
+            "uuid": str(self.uuid)
+        }
+
+        if include_signature:
+            ret["signature"] = binary_to_ascii(self.signature) if self.signature is not None else b''
+
+        return ret
+
+    def __str__(self) -> str:
+        # Function converts this object to a string, without the private key
+        return str(self.to_ascii_dict())
+
+    def hash(self) -> str:
+        # Gets the SHA256 hash digest in hexadecimal of this transaction, used as its leaf in a block's merkle tree
+        return hashlib.sha256(str(self).encode("ascii")).hexdigest()
+
+
+class Transaction(TransactionFormat, db.Model, metaclass=FormatModelMeta):
     """Class represents a transaction inside a block"""
 
     # Database Entries
@@ -40,9 +86,9 @@ class Transaction(db.Model):
 
     def __init__(
             self,
-            sender_public_key: RSAPublicKey,
-            sender_private_key: Union[None, RSAPrivateKey],
-            recipient_public_key: RSAPublicKey,
+            sender_public_key: PublicKey,
+            sender_private_key: Union[None, PrivateKey],
+            recipient_public_key: PublicKey,
             amount: int, trans_uuid: UUID):
         self.sender_public_key = sender_public_key
         self.sender_private_key = sender_private_key
@@ -61,40 +107,19 @@ class Transaction(db.Model):
             "uuid": self.uuid
         }
 
-    def to_ascii_dict(self, include_signature=False) -> dict:
-        # Similarly, function returns an ascii dictionary of this transaction, without the private key
-        # signatures should only be included if the transaction has already been placed in a block
-
-        ret = {
-            "sender_public_key": binary_to_ascii(
-                self.sender_public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)),
-            "recipient_public_key": binary_to_ascii(
-                self.recipient_public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)),
-            "amount": self.amount,
-            "uuid": str(self.uuid)
-        }
-
-        if include_signature:
-            ret["signature"] = binary_to_ascii(self.signature) if self.signature is not None else b''
+    def ascii_keys(self) -> Tuple[str, str]:
+        return public_key_to_ascii_key(self.sender_public_key), public_key_to_ascii_key(self.recipient_public_key)
 
-        return ret
+    def sign(self, signer: Signer = signatures.sign) -> None:
+        # Function creates and sets the signature of this transaction, signed by the private key of the sender
+        # The signature scheme is that of the sender's key, signer can be given to sign elsewhere (e.g. a CryptoPool)
+        self.signature = signer(self.sender_private_key, str(self).encode("ascii"))
 
-    def __str__(self) -> str:
-        # Function converts this object to a string, without the private key
-        return str(self.to_ascii_dict())
+    def signed(self) -> Tuple[PublicKey, bytes, bytes]:
+        # Function returns the (public key, signature, message) to verify the signature of this transaction with
+        return self.sender_public_key, self.signature, str(self).encode("ascii")
 
-    def sign(self) -> None:
-        # Function creates and sets the signature of this transaction, signed by the private key of the sender
-        self.signature = self.sender_private_key.sign(
-            str(self).encode("ascii"),
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
-
-    def is_valid(self) -> bool:
+    def is_valid(self, verifier: Verifier = signatures.verify) -> bool:
         # Function checks if this transaction is valid by verifying the signature with the sender's public key
 
         # Signature wasn't set
@@ -102,26 +127,83 @@ class Transaction(db.Model):
             return False
 
         # Use public key to verify signature
-        try:
-            self.sender_public_key.verify(
-                self.signature,
-                str(self).encode("ascii"),
-                padding.PSS(
-                    mgf=padding.MGF1(hashes.SHA256()),
-                    salt_length=padding.PSS.MAX_LENGTH
-                ),
-                hashes.SHA256()
-            )
-            return True
-        except InvalidSignature:
-            return False
+        return verifier(*self.signed())
+
+
+class BlockFormat(ABC):
+    """
+        Class represents the serialization and hashing of a block, shared by Block and its read model
+        Subclasses have uuid, index, block_hash, proof_of_work, previous_block_hash, merkle_root and transactions
+        attributes, where transactions are TransactionFormat
+    """
+
+    __slots__ = ()
 
+    @abstractmethod
+    def ascii_miner_key(self) -> str:
+        # Function returns the miner's key in ascii, empty if the block hasn't been mined
+        pass
 
-class Block(db.Model):
+    def to_bytes(self, include_proof_of_work=False, include_miner_key=False) -> bytes:
+        # Gets this current block to bytes
+        # proof of work is optional as the miner is expected to create the proof of work
+        # miner key is optional as the miner is expected to provide their miner key
+
+        mining_bytes = bytearray()
+
+        if include_miner_key:
+            mining_bytes += self.ascii_miner_key().encode("ascii")
+
+        # Add in the merkle root of the transactions and this block's information
+        mining_bytes += bytes.fromhex(self.merkle_root)
+        mining_bytes += bytes.fromhex(self.previous_block_hash)
+        mining_bytes += str(self.uuid).encode("ascii")
+
+        if include_proof_of_work:
+            mining_bytes += str(self.proof_of_work).encode("ascii")
+
+        return mining_bytes
+
+    def hash(self, include_proof_of_work=True, include_miner_key=False) -> str:
+        # Gets the SHA256 hash digest in hexadecimal, both proof of work and miner key is optional,
+        # however when verifying if this block is mined and begins with x amount of zeros, both should be set to true
+        return hashlib.sha256(self.to_bytes(include_proof_of_work, include_miner_key)).hexdigest()
+
+    def merkle_leaves(self) -> List[str]:
+        # Function returns the transaction hashes of this block in the order of the merkle tree's leaves
+        # They are sorted so the tree doesn't depend on the order the transactions were loaded from the database
+        return sorted(transaction.hash() for transaction in self.transactions)
+
+    def compute_merkle_root(self) -> str:
+        # Function computes the merkle root of this block's transactions
+        return merkle_root(self.merkle_leaves())
+
+    def merkle_proof(self, transaction: TransactionFormat) -> List[Tuple[str, str]]:
+        # Function returns the merkle path proving transaction is in this block, see merkle_path()
+        leaves = self.merkle_leaves()
+        return merkle_path(leaves, leaves.index(transaction.hash()))
+
+    def to_chain_dict(self) -> dict:
+        # Function returns an ascii dictionary of this block once it is in the chain, with everything needed to
+        # recreate it with from_chain_dict()
+        return {
+            "index": self.index,
+            "uuid": str(self.uuid),
+            "hash": self.block_hash,
+            "proof_of_work": self.proof_of_work,
+            "previous_hash": self.previous_block_hash,
+            "merkle_root": self.merkle_root,
+            "miner_key": self.ascii_miner_key(),
+            "transactions": [trans.to_ascii_dict(include_signature=True) for trans in self.transactions]
+        }
+
+
+class Block(BlockFormat, db.Model, metaclass=FormatModelMeta):
     """
         Class represents a block used in a blockchain, a block itself may have multiple transactions
         Note that when mining, it's expected that the final block/bytes given is:
         [miner's public key]|[block's mining input]|[proof of work]
+        The block commits to its transactions with a merkle root, so the mining input is a fixed size
     """
 
     # Database Entries
@@ -134,9 +216,11 @@ class Block(db.Model):
     transactions = db.relationship("Transaction", backref="block", lazy=True)
     index = db.Column(db.Integer, nullable=True)
     block_hash = db.Column(db.String(64), nullable=True)
+    merkle_root = db.Column(db.String(64), nullable=False)
 
     def __init__(self, transactions: List[Transaction], previous_block_hash: str):
         self.transactions = transactions
+        self.merkle_root = self.compute_merkle_root()
         self.proof_of_work = 0
         self.previous_block_hash = previous_block_hash
         self.uuid = uuid.uuid4()
@@ -149,40 +233,11 @@ class Block(db.Model):
         # Returns the mining representation of this block, used by miners
         return str(base64.b64encode(self.to_bytes()), "utf-8")
 
-    def to_bytes(self, include_proof_of_work=False, include_miner_key=False) -> bytes:
-        # Gets this current block to bytes
-        # proof of work is optional as the miner is expected to create the proof of work
-        # miner key is optional as the miner is expected to provide their miner key
-
-        mining_bytes = bytearray()
-
-        if include_miner_key:
-            mining_bytes += str(self.miner_key).encode("ascii")
-
-        # Add in each transaction and this block's information
-        for transaction in self.transactions:
-            mining_bytes += str(transaction).encode("ascii")
-        mining_bytes += bytes.fromhex(self.previous_block_hash)
-        mining_bytes += str(self.uuid).encode("ascii")
-
-        if include_proof_of_work:
-            mining_bytes += str(self.proof_of_work).encode("ascii")
-
-        return mining_bytes
-
-    def hash(self, include_proof_of_work=True, include_miner_key=False) -> str:
-        # Gets the SHA256 hash digest in hexadecimal, both proof of work and miner key is optional,
-        # however when verifying if this block is mined and begins with x amount of zeros, both should be set to true
-        return hashlib.sha256(self.to_bytes(include_proof_of_work, include_miner_key)).hexdigest()
-
-    def check_proof_of_work(self, other_proof: int, miner_public_key: str) -> str:
+    def check_proof_of_work(self, other_proof: int, miner_public_key: str,
+                            verifier: BatchVerifier = signatures.verify_many) -> str:
         # Function checks if the proof of work given with the miner's key results in n amount of zeros
         # Function returns an error message - empty string if this proof of work works with this block
 
-        # Ensure this block's transactions are valid first before setting proof and miner key
-        if not self.is_valid():
-            return "This block contains invalid transactions and will not be accepted for addition into the blockchain"
-
         # Set the proof and miner's key
         previous_proof = self.proof_of_work
         self.proof_of_work = other_proof
@@ -197,14 +252,25 @@ class Block(db.Model):
             self.miner_key = None
             return f"Proof of work {other_proof} gave SHA256 {block_hash} which does not start with {start_num_zeros}"
 
+        # Only now ensure this block's transactions are valid, checking signatures costs far more than a hash so it's
+        # only done for proofs that would win
+        if not self.is_valid(verifier):
+            self.proof_of_work = previous_proof
+            self.miner_key = None
+            return "This block contains invalid transactions and will not be accepted for addition into the blockchain"
+
         # set the hash
         self.block_hash = block_hash
 
         return ""
 
-    def is_valid(self) -> bool:
-        # Function checks this block is valid, defined by all transactions being valid
-        return all(transaction.is_valid() for transaction in self.transactions)
+    def is_valid(self, verifier: BatchVerifier = signatures.verify_many) -> bool:
+        # Function checks this block is valid, defined by all transactions being valid and the merkle root
+        # matching the transactions. The signatures of all transactions are given to verifier at once
+        if self.merkle_root != self.compute_merkle_root() or \
+                any(len(transaction.signature) == 0 for transaction in self.transactions):
+            return False
+        return all(verifier([transaction.signed() for transaction in self.transactions]))
 
     def __str__(self) -> str:
         # Function converts this object to a string, without the private key
@@ -217,15 +283,55 @@ class Block(db.Model):
         yield "previous_block_hash", self.previous_block_hash
         yield "proof_of_work", self.proof_of_work
 
+    def ascii_miner_key(self) -> str:
+        # The key is kept as the miner gave it until it's reloaded
+        if self.miner_key is None:
+            return ""
+        if isinstance(self.miner_key, str):
+            return self.miner_key
+        return public_key_to_ascii_key(self.miner_key)
+
+    @classmethod
+    def from_chain_dict(cls, block_dict: dict):
+        # Function recreates a block in the chain from its ascii dictionary given by to_chain_dict()
+        # Throws ValueError if the merkle root doesn't match the transactions
+        transactions = []
+        for trans_dict in block_dict["transactions"]:
+            transaction = Transaction(ascii_key_to_public_key(trans_dict["sender_public_key"]),
+                                      None,
+                                      ascii_key_to_public_key(trans_dict["recipient_public_key"]),
+                                      trans_dict["amount"],
+                                      uuid.UUID(trans_dict["uuid"]))
+            transaction.signature = ascii_to_binary(trans_dict["signature"])
+            transaction.has_been_mined = True
+            transactions.append(transaction)
+
+        block = cls(transactions, block_dict["previous_hash"])
+        if block.merkle_root != block_dict["merkle_root"]:
+            raise ValueError(f"Block {block_dict['uuid']}'s merkle root does not match its transactions")
+
+        block.uuid = uuid.UUID(block_dict["uuid"])
+        for transaction in transactions:
+            transaction.block_id = block.uuid
+        block.index = block_dict["index"]
+        block.block_hash = block_dict["hash"]
+        block.proof_of_work = block_dict["proof_of_work"]
+        # The miner's key is kept in the ascii form the miner gave, as the block's hash was made with it
+        block.miner_key = block_dict["miner_key"] if block_dict["miner_key"] else None
+        block.is_mining_block = False
+        return block
+
     @classmethod
     def genesis_block(cls):
         # Function creates the genesis block, the first block in our blockchain
+        # Every node creates the same genesis block, so blocks from peers can be chained onto it
 
         hash_creator = hashlib.sha256()
         hash_creator.update(b'')
 
         genesis = cls([], hash_creator.digest().hex())
 
+        genesis.uuid = genesis_block_uuid
         genesis.previous_block_hash = '0' * 64
         genesis.is_mining_block = False
         genesis.index = 0
@@ -234,13 +340,176 @@ class Block(db.Model):
         return genesis
 
 
+# Read models are lightweight read-only views of the blocks and transactions in the chain, for reading through the
+# chain without the cost of ORM objects. Rows are fetched with core selects, keys are kept in their raw bytes and
+# uuids in their text, while serializing and hashing is shared with Block and Transaction
+
+# The key and uuid columns are read as is, rather than through dbmodels' conversions
+block_table = Block.__table__
+transaction_table = Transaction.__table__
+block_columns = [
+    type_coerce(block_table.c.uuid, types.TEXT),
+    block_table.c.index,
+    block_table.c.block_hash,
+    block_table.c.proof_of_work,
+    block_table.c.previous_block_hash,
+    block_table.c.merkle_root,
+    type_coerce(block_table.c.miner_key, types.BINARY)
+]
+transaction_columns = [
+    type_coerce(transaction_table.c.uuid, types.TEXT),
+    type_coerce(transaction_table.c.sender_public_key, types.BINARY),
+    type_coerce(transaction_table.c.recipient_public_key, types.BINARY),
+    transaction_table.c.amount,
+    transaction_table.c.signature,
+    type_coerce(transaction_table.c.block_id, types.TEXT)
+]
+
+
+class TransactionView(TransactionFormat):
+    """Class represents a read-only transaction in the chain"""
+
+    __slots__ = ("uuid", "sender_public_key", "recipient_public_key", "amount", "signature", "block_id")
+
+    def __init__(self, trans_uuid: str, sender_public_key: bytes, recipient_public_key: bytes, amount: int,
+                 signature: bytes, block_id: str):
+        self.uuid = trans_uuid
+        self.sender_public_key = sender_public_key
+        self.recipient_public_key = recipient_public_key
+        self.amount = amount
+        self.signature = signature
+        self.block_id = block_id
+
+    def ascii_keys(self) -> Tuple[str, str]:
+        return binary_to_ascii(self.sender_public_key), binary_to_ascii(self.recipient_public_key)
+
+
+class BlockView(BlockFormat):
+    """Class represents a read-only block in the chain"""
+
+    __slots__ = ("uuid", "index", "block_hash", "proof_of_work", "previous_block_hash", "merkle_root", "miner_key",
+                 "transactions")
+
+    def __init__(self, block_uuid: str, index: int, block_hash: str, proof_of_work: int, previous_block_hash: str,
+                 merkle_root: str, miner_key: Union[None, bytes], transactions: List[TransactionView]):
+        self.uuid = block_uuid
+        self.index = index
+        self.block_hash = block_hash
+        self.proof_of_work = proof_of_work
+        self.previous_block_hash = previous_block_hash
+        self.merkle_root = merkle_root
+        self.miner_key = miner_key
+        self.transactions = transactions
+
+    def ascii_miner_key(self) -> str:
+        # A missing key is stored as b"0", see dbmodels.KeyModel
+        if self.miner_key is None or self.miner_key == b"0":
+            return ""
+        return binary_to_ascii(self.miner_key)
+
+
+def iter_block_views(start_index: int = 0, end_index: int = None, batch_size: int = 500) -> Iterator[BlockView]:
+    # Function iterates over the blocks in the chain from start_index to end_index (inclusive) in index order
+    # Blocks are fetched batch_size at a time, with the transactions of each batch fetched in one select
+    next_index = start_index
+    while True:
+        query = select(*block_columns) \
+            .where(block_table.c.is_mining_block.is_(False), block_table.c.index >= next_index) \
+            .order_by(block_table.c.index).limit(batch_size)
+        if end_index is not None:
+            query = query.where(block_table.c.index <= end_index)
+        block_rows = db.session.execute(query).all()
+        if len(block_rows) == 0:
+            return
+
+        transactions = defaultdict(list)
+        block_uuids = [row[0] for row in block_rows]
+        transaction_query = select(*transaction_columns).where(
+            type_coerce(transaction_table.c.block_id, types.TEXT).in_(block_uuids))
+        for row in db.session.execute(transaction_query):
+            transactions[row[5]].append(TransactionView(*row))
+
+        for row in block_rows:
+            yield BlockView(*row, transactions[row[0]])
+
+        next_index = block_rows[-1][1] + 1
+
+
+def get_block_view(index: int) -> Union[None, BlockView]:
+    # Function returns the block in the chain with this index, None if there isn't one
+    return next(iter_block_views(index, index), None)
+
+
+class BlockStore(ABC):
+    """
+        Class represents the storage of the blocks in the chain, used for reading the chain in index order
+        Blocks are given and returned as dictionaries from Block.to_chain_dict()
+    """
+
+    @abstractmethod
+    def append(self, block_dict: dict, is_checkpoint: bool = False) -> None:
+        # Function stores a block that was added to the chain, blocks must be appended in index order without gaps
+        # Only the tip of a checkpoint (see snapshot.import_snapshot()) may follow a gap, as the blocks before it are
+        # back-filled later and only kept in the database
+        pass
+
+    @abstractmethod
+    def get_block(self, index: int) -> Union[None, dict]:
+        # Function returns the block in the chain with this index, None if there isn't one
+        pass
+
+    @abstractmethod
+    def iter_blocks(self, start_index: int = 0, end_index: int = None) -> Iterator[dict]:
+        # Function iterates over the blocks in the chain from start_index to end_index (inclusive) in index order
+        pass
+
+    @abstractmethod
+    def tip_index(self) -> int:
+        # Function returns the index of the last block in the chain, -1 if there are no blocks
+        pass
+
+
+class SQLBlockStore(BlockStore):
+    """Class represents the storage of the blocks in the chain by the database, where every block is stored anyway"""
+
+    def append(self, block_dict: dict, is_checkpoint: bool = False) -> None:
+        # The block has already been stored in the database
+        pass
+
+    def get_block(self, index: int) -> Union[None, dict]:
+        block = get_block_view(index)
+        return block.to_chain_dict() if block is not None else None
+
+    def iter_blocks(self, start_index: int = 0, end_index: int = None) -> Iterator[dict]:
+        for block in iter_block_views(start_index, end_index):
+            yield block.to_chain_dict()
+
+    def tip_index(self) -> int:
+        tip_index = db.session.query(func.max(Block.index)).filter(Block.is_mining_block.is_(False)).scalar()
+        return tip_index if tip_index is not None else -1
+
+
 class BlockChain:
     """Class represents an entire block chain, represents methods for the mining into a blockchain"""
 
-    def __init__(self):
-        self.used_block_uuids = set()  # All uuids ever given out for a block generated in this class
+    def __init__(self, block_store: BlockStore = None):
+        self.used_block_uuids = set()  # All uuids ever given out for a block generated in or loaded by this class
+        self.mining_blocks = {}  # The uuids of the blocks that can still be mined, to their previous block hash
+        self.tip_hash = None  # The hash of the last block in the chain, as last seen by this class
+        self.loaded_at = 0.0  # When the mining blocks and tip were last loaded from the database
+        self.block_store = block_store if block_store is not None else SQLBlockStore()
 
     max_transactions_const = 3  # maximum amount of transactions that can fit into a block
+    reload_interval = 1.0  # seconds before the mining blocks are loaded again for a block uuid that isn't known
+
+    def load_mining_blocks(self) -> None:
+        # Function loads the tip and the mining blocks from the database, such as at startup or when they were created
+        # by another process
+        self.tip_hash = Block.query.filter_by(is_mining_block=False).order_by(Block.index.desc()).first().hash()
+        self.mining_blocks = dict(db.session.query(Block.uuid, Block.previous_block_hash)
+                                  .filter(Block.is_mining_block.is_(True)).all())
+        self.used_block_uuids.update(self.mining_blocks)
+        self.loaded_at = time.monotonic()
 
     def create_mining_blocks(self) -> None:
         # Function creates the minable blocks from the transactions given to the coinbase
@@ -260,7 +529,8 @@ class BlockChain:
             return None
 
         # Create all new mining blocks
-        prev_block_hash = Block.query.filter_by(is_mining_block=False)[-1].hash()
+        prev_block_hash = Block.query.filter_by(is_mining_block=False).order_by(Block.index.desc()).first().hash()
+        self.tip_hash = prev_block_hash
 
         # partition transactions into n sized arrays to put into each block
         for i in range(0, len(non_mined_transactions), BlockChain.max_transactions_const):
@@ -268,15 +538,30 @@ class BlockChain:
             block = Block(transaction_blocks, prev_block_hash)
             db.session.add(block)
             self.used_block_uuids.add(block.uuid)
+            self.mining_blocks[block.uuid] = prev_block_hash
         db.session.commit()
 
-    @staticmethod
-    def clear_mining_blocks() -> None:
+    def clear_mining_blocks(self) -> None:
         # Function simply clears the mining blocks and allows for more mining blocks to be generated
+        self.mining_blocks.clear()
         bad_blocks = Block.query.filter_by(is_mining_block=True).delete()
         print(f"Cleared {bad_blocks} bad blocks")
         db.session.commit()
 
+    def precheck_mine_block(self, block_uuid: UUID) -> str:
+        # Function cheaply checks if a mining block can still be mined, mostly without going to the database
+        # Returns an error message - empty string if it may be minable. Blocks not known here, such as ones created by
+        # another process, are loaded at most once every reload_interval and are otherwise left to find_mine_block
+        if block_uuid not in self.used_block_uuids and time.monotonic() - self.loaded_at >= self.reload_interval:
+            self.load_mining_blocks()
+        if block_uuid not in self.used_block_uuids:
+            return ""
+
+        # The tip only moves forward, so a block built on another one can no longer be mined
+        if block_uuid not in self.mining_blocks or self.mining_blocks[block_uuid] != self.tip_hash:
+            return "This block is no longer valid due to a blockchain addition"
+        return ""
+
     def find_mine_block(self, block_uuid: uuid) -> Union[Tuple[str, bool, Block], Tuple[str, bool, None]]:
         # Function finds a mining block given the block's uuid
         # Returns an error message, If error is fatal to a miner, and the block
@@ -294,8 +579,7 @@ class BlockChain:
                 return "This block has already been mined and is in the blockchain", False, None
         return "Success", False, found_block
 
-    @staticmethod
-    def move_minable_block(block: Block) -> None:
+    def move_minable_block(self, block: Block) -> None:
         # Function moves a block that is from self.transactions to the chain
         block.is_mining_block = False
         max_index = db.session.query(func.max(Block.index)).scalar()
@@ -303,8 +587,42 @@ class BlockChain:
         block.index = max_index + 1
         for transaction in block.transactions:
             transaction.has_been_mined = True
+        block_dict = block.to_chain_dict()
+        db.session.add_all(AddressHistory.from_block(block_dict))
+        db.session.commit()
+        self.tip_hash = block.hash()
+        self.sync_block_store()
+
+    def sync_block_store(self) -> None:
+        # Function appends the blocks in the database that are missing from the block store, such as when a block
+        # store is first used or blocks were added by another process, so the store never skips over any of them
+        checkpoint = self.checkpoint()
+        for block_dict in SQLBlockStore().iter_blocks(self.block_store.tip_index() + 1):
+            self.block_store.append(block_dict, checkpoint is not None and block_dict["index"] == checkpoint.index)
+
+    def sync_address_history(self) -> None:
+        # Function adds the address history of the blocks in the chain that haven't been indexed yet
+        last_index = db.session.query(func.max(AddressHistory.block_index)).scalar()
+        for block_dict in self.block_store.iter_blocks(last_index + 1 if last_index is not None else 0):
+            db.session.add_all(AddressHistory.from_block(block_dict))
         db.session.commit()
 
+    @staticmethod
+    def check_schema() -> None:
+        # Function checks the tables in the database have every column of the models, create_all() only creates
+        # missing tables and doesn't add columns to those made by older versions
+        # Throws RuntimeError naming the missing columns if they don't
+        inspector = inspect(db.engine)
+        missing_columns = []
+        for table in db.metadata.sorted_tables:
+            stored_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            missing_columns.extend(f"{table.name}.{name}" for name in table.columns.keys()
+                                   if name not in stored_columns)
+        if missing_columns:
+            raise RuntimeError(f"The database was made by an older version and is missing the columns "
+                               f"{', '.join(missing_columns)}, delete it (or use a new --database) to start "
+                               f"a new one")
+
     @staticmethod
     def check_genesis_block():
         # Creates a genesis block with no transactions only if there isn't one
@@ -312,6 +630,109 @@ class BlockChain:
             db.session.add(Block.genesis_block())
             db.session.commit()
 
+    @staticmethod
+    def checkpoint() -> Union[None, "Checkpoint"]:
+        # Function returns the checkpoint this chain was bootstrapped from with a snapshot, None if there isn't one
+        return Checkpoint.query.order_by(Checkpoint.index.desc()).first()
+
+
+class Checkpoint(db.Model):
+    """
+        Class represents the chain state a node was bootstrapped from with a snapshot
+        Blocks up to and including index are not counted on this node, their balances are instead kept in
+        CheckpointBalance. Only the tip itself is stored until the blocks before it are back-filled from peers
+    """
+
+    # Database Entries
+    __tablename__ = "checkpoint"
+    index = db.Column(db.Integer, primary_key=True)
+    chain_hash = db.Column(db.String(64), nullable=False)  # rolling hash of the chain up to and including the tip
+    previous_chain_hash = db.Column(db.String(64), nullable=False)  # rolling hash of the chain before the tip
+
+    def __init__(self, index: int, chain_hash: str, previous_chain_hash: str):
+        self.index = index
+        self.chain_hash = chain_hash
+        self.previous_chain_hash = previous_chain_hash
+
+
+class CheckpointBalance(db.Model):
+    """Class represents the balance of a key at the checkpoint"""
+
+    # Database Entries
+    __tablename__ = "checkpoint_balance"
+    public_key = db.Column(dbmodels.KeyModel, primary_key=True)
+    balance = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, public_key: PublicKey, balance: int):
+        self.public_key = public_key
+        self.balance = balance
+
+
+class AddressHistory(db.Model):
+    """
+        Class represents an entry in the history of an address, being a transaction or a mining reward of a block
+        Entries are looked up by the hash of the address's key, newest first by block, as blocks back-filled from peers
+        are added after the blocks following them
+    """
+
+    # Database Entries
+    __tablename__ = "address_history"
+    id = db.Column(db.Integer, primary_key=True)
+    key_hash = db.Column(db.String(64), nullable=False)
+    block_index = db.Column(db.Integer, nullable=False)
+    transaction_uuid = db.Column(dbmodels.UUIDModel, nullable=True)  # None for mining rewards
+    direction = db.Column(db.String(8), nullable=False)  # "sent", "received" or "mined"
+    amount = db.Column(db.Integer, nullable=False)
+    __table_args__ = (db.Index("ix_address_history_key_hash_block_index_id", "key_hash", "block_index", "id"),)
+
+    def __init__(self, key_hash: str, block_index: int, transaction_uuid: Union[None, UUID], direction: str,
+                 amount: int):
+        self.key_hash = key_hash
+        self.block_index = block_index
+        self.transaction_uuid = transaction_uuid
+        self.direction = direction
+        self.amount = amount
+
+    def to_ascii_dict(self) -> dict:
+        return {
+            "block_index": self.block_index,
+            "transaction_uuid": str(self.transaction_uuid) if self.transaction_uuid else "",
+            "direction": self.direction,
+            "amount": self.amount
+        }
+
+    @staticmethod
+    def hash_key(key_bytes: bytes) -> str:
+        # Function gets the hash of an address's key bytes that its history is kept under
+        return hashlib.sha256(key_bytes).hexdigest()
+
+    @classmethod
+    def from_block(cls, block_dict: dict) -> List["AddressHistory"]:
+        # Function creates the history entries of a block in the chain, given by Block.to_chain_dict()
+        entries = []
+        if block_dict["miner_key"]:
+            entries.append(cls(cls.hash_key(ascii_to_binary(block_dict["miner_key"])), block_dict["index"], None,
+                               "mined", block_mining_reward))
+        for trans_dict in block_dict["transactions"]:
+            trans_uuid = UUID(trans_dict["uuid"])
+            entries.append(cls(cls.hash_key(ascii_to_binary(trans_dict["sender_public_key"])), block_dict["index"],
+                               trans_uuid, "sent", trans_dict["amount"]))
+            entries.append(cls(cls.hash_key(ascii_to_binary(trans_dict["recipient_public_key"])),
+                               block_dict["index"], trans_uuid, "received", trans_dict["amount"]))
+        return entries
+
+    @classmethod
+    def page(cls, public_key: PublicKey, cursor: Union[None, int], limit: int) -> List["AddressHistory"]:
+        # Function gets up to limit entries of a key's history, newest first, starting after the entry with id cursor
+        history = cls.query.filter_by(key_hash=cls.hash_key(signatures.public_key_to_bytes(public_key)))
+        if cursor is not None:
+            cursor_entry = cls.query.filter_by(id=cursor).one_or_none()
+            if cursor_entry is None:
+                return []
+            history = history.filter(or_(cls.block_index < cursor_entry.block_index,
+                                         and_(cls.block_index == cursor_entry.block_index, cls.id < cursor)))
+        return history.order_by(cls.block_index.desc(), cls.id.desc()).limit(limit).all()
+
 
 class CoinBase(db.Model):
     # Class represents a coinbase with it's own wallet
@@ -322,7 +743,7 @@ class CoinBase(db.Model):
     private_key = db.Column(dbmodels.KeyModel(is_private_key=True), nullable=True)
     server = db.Column(db.String(60), nullable=True)
 
-    def __init__(self, pkey: Union[None, RSAPublicKey], skey: Union[None, RSAPrivateKey], server: str):
+    def __init__(self, pkey: Union[None, PublicKey], skey: Union[None, PrivateKey], server: str):
         self.public_key = pkey
         self.private_key = skey
         self.server = server
@@ -333,11 +754,11 @@ class CoinBase(db.Model):
             self.public_key = server_wallet.public_key
             self.private_key = server_wallet.private_key
 
-    def give_key_coins(self, public_key: RSAPublicKey, amount: int) -> None:
+    def give_key_coins(self, public_key: PublicKey, amount: int, signer: Signer = signatures.sign) -> None:
         # Function gives public_key amount number of coins (for free)
         # Simply makes it a new transaction to be added
         transaction = Transaction(self.public_key, self.private_key, public_key, amount, uuid.uuid4())
-        transaction.sign()
+        transaction.sign(signer)
         db.session.add(transaction)
         db.session.commit()
 
@@ -352,46 +773,65 @@ class CoinBase(db.Model):
             db.session.commit()
         else:
             # No other coinbases will give us a private key
-            coinbase = CoinBase.query.filter(CoinBase.private_key.isnot(None)).first()
+            # A missing private key is stored as b"0" rather than NULL, so this is checked once loaded
+            coinbase = next(other for other in CoinBase.query.all() if other.private_key is not None)
+
+        # The coinbase outlives the session it was loaded in, so it's loaded fully and detached from it
+        db.session.refresh(coinbase)
+        db.session.expunge(coinbase)
         return coinbase
 
     @staticmethod
-    def get_key_balance(public_key: RSAPublicKey) -> int:
+    def peers() -> List["CoinBase"]:
+        # Function returns the coinbases of the other nodes this node knows of
+        return [other for other in CoinBase.query.all() if other.private_key is None]
+
+    @staticmethod
+    def get_key_balance(public_key: PublicKey) -> int:
         # Function gets the balance of a public key
 
         def none_to_zero(val):
             # 0 if val is of None type else val
             return 0 if val is None else val
 
+        # If this node was bootstrapped from a snapshot, start from the balance at the checkpoint
+        # and only count the blocks after it
+        checkpoint = BlockChain.checkpoint()
+        checkpoint_index = checkpoint.index if checkpoint is not None else -1
+        checkpoint_balance = CheckpointBalance.query.filter_by(public_key=public_key).one_or_none()
+        start_balance = checkpoint_balance.balance if checkpoint_balance is not None else 0
+
         # Three ways a key can have balance
 
         # 1. If they mined blocks, per each block they get rewarded some amount of coins
-        mined_balance = Block.query.filter_by(miner_key=public_key).count() * block_mining_reward
+        mined_balance = Block.query.filter_by(miner_key=public_key) \
+            .filter(Block.index > checkpoint_index).count() * block_mining_reward
 
         # 2. If they received coins from someone else in a transaction
-        received_balance = Transaction.query.with_entities(func.sum(Transaction.amount).label("total")) \
-            .filter_by(has_been_mined=True, recipient_public_key=public_key) \
+        received_balance = Transaction.query.join(Block) \
+            .with_entities(func.sum(Transaction.amount).label("total")) \
+            .filter(Transaction.has_been_mined.is_(True), Transaction.recipient_public_key == public_key,
+                    Block.index > checkpoint_index) \
             .first().total
 
         # 3. If they've sent coins to someone else
-        sent_balance = Transaction.query.with_entities(func.sum(Transaction.amount).label("total")) \
-            .filter_by(has_been_mined=True, sender_public_key=public_key) \
+        sent_balance = Transaction.query.join(Block) \
+            .with_entities(func.sum(Transaction.amount).label("total")) \
+            .filter(Transaction.has_been_mined.is_(True), Transaction.sender_public_key == public_key,
+                    Block.index > checkpoint_index) \
             .first().total
 
-        return mined_balance + none_to_zero(received_balance) - none_to_zero(sent_balance)
+        return start_balance + mined_balance + none_to_zero(received_balance) - none_to_zero(sent_balance)
 
 
 class Wallet:
     # Class represents a wallet
 
-    def __init__(self, generate_keys=True):
+    def __init__(self, generate_keys=True, scheme: SignatureScheme = signatures.default_scheme):
         self.private_key = None
         self.public_key = db.Column(dbmodels.KeyModel, primary_key=True)
         if generate_keys:
-            self.private_key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=512
-            )
+            self.private_key = scheme.generate_private_key()
             self.public_key = self.private_key.public_key()
 
     @classmethod
@@ -406,21 +846,65 @@ class Wallet:
     def from_binary_keys(cls, private_key: bytes, public_key: bytes):
         # Function creates a new Wallet object with private/public keys given in a binary format
         wallet = cls(False)
-        wallet.private_key = serialization.load_der_private_key(private_key, None)
-        wallet.public_key = serialization.load_der_public_key(public_key)
+        wallet.private_key = signatures.load_private_key(private_key)
+        wallet.public_key = signatures.load_public_key(public_key)
         return wallet
 
     def keys_to_bytes(self) -> Tuple[bytes, bytes]:
         # Function returns both (private key, public key) pair in bytes
 
-        return (self.private_key.private_bytes(Encoding.DER, PrivateFormat.PKCS8, NoEncryption()),
-                self.public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo))
+        return (signatures.private_key_to_bytes(self.private_key),
+                signatures.public_key_to_bytes(self.public_key))
 
     def keys_to_ascii(self) -> Tuple[str, ...]:
         # Function returns both (private key,public key) pair in an ascii encoding
         return tuple(binary_to_ascii(key) for key in self.keys_to_bytes())
 
 
+def merkle_parent(left: str, right: str) -> str:
+    # Function hashes two hexadecimal merkle tree nodes into their parent node
+    return hashlib.sha256(bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def merkle_root(hashes: List[str]) -> str:
+    # Function computes the merkle root of a list of hexadecimal hashes, levels with an odd amount of nodes
+    # have their last node paired with itself. The root of no hashes is the hash of nothing
+    if len(hashes) == 0:
+        return hashlib.sha256(b"").hexdigest()
+
+    level = hashes
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level = level + [level[-1]]
+        level = [merkle_parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+    return level[0]
+
+
+def merkle_path(hashes: List[str], index: int) -> List[Tuple[str, str]]:
+    # Function returns the merkle path of the hash at index as a list of (sibling hash, side of sibling) from the
+    # leaves up, where side is "left" or "right". Hashing the leaf with each sibling in turn gives the merkle root
+    path = []
+    level = hashes
+    while len(level) > 1:
+        if len(level) % 2 == 1:
+            level = level + [level[-1]]
+        if index % 2 == 0:
+            path.append((level[index + 1], "right"))
+        else:
+            path.append((level[index - 1], "left"))
+        level = [merkle_parent(level[i], level[i + 1]) for i in range(0, len(level), 2)]
+        index //= 2
+    return path
+
+
+def verify_merkle_path(leaf: str, path: List[Tuple[str, str]], root: str) -> bool:
+    # Function checks if a merkle path given by merkle_path() proves leaf is under root
+    node = leaf
+    for sibling, side in path:
+        node = merkle_parent(sibling, node) if side == "left" else merkle_parent(node, sibling)
+    return node == root
+
+
 def binary_to_ascii(binary_item: bytes) -> str:
     # Function converts bytes to an ascii string
     return binascii.hexlify(binary_item).decode("ascii")
@@ -431,18 +915,18 @@ def ascii_to_binary(ascii_item: str) -> bytes:
     return binascii.unhexlify(ascii_item)
 
 
-def ascii_key_to_public_key(ascii_key: str) -> RSAPublicKey:
+def ascii_key_to_public_key(ascii_key: str) -> PublicKey:
     # function converts an ascii representation of a public key to bytes
-    return serialization.load_der_public_key(binascii.unhexlify(ascii_key))
+    return signatures.load_public_key(binascii.unhexlify(ascii_key))
 
 
-def public_key_to_ascii_key(pkey: RSAPublicKey) -> str:
-    return binary_to_ascii(pkey.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo))
+def public_key_to_ascii_key(pkey: PublicKey) -> str:
+    return binary_to_ascii(signatures.public_key_to_bytes(pkey))
 
 
-def ascii_key_to_private_key(ascii_key: str, password: bytes = None) -> RSAPrivateKey:
-    # Function loads an ascii key to form a RSA private key
-    return serialization.load_der_private_key(binascii.unhexlify(ascii_key), password)
+def ascii_key_to_private_key(ascii_key: str, password: bytes = None) -> PrivateKey:
+    # Function loads an ascii key to form a private key
+    return signatures.load_private_key(binascii.unhexlify(ascii_key), password)
 
 
 def serializer(obj):
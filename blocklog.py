@@ -0,0 +1,155 @@
+import fcntl
+import json
+import mmap
+import os
+import struct
+from contextlib import contextmanager
+from typing import Iterator, Tuple, Union
+
+from blockchain import BlockStore
+
+# A block log stores the blocks in the chain in append-only segment files, read back with memory maps
+# segment-[n].log: records of [record length][json of Block.to_chain_dict()], a new segment is started once one is full
+# index: fixed size entries of [block index][segment][offset of record], one per block in index order
+
+record_length_format = struct.Struct(">I")
+index_entry_format = struct.Struct(">QIQ")
+
+
+@contextmanager
+def map_file(path: str):
+    # Function memory maps a file for reading, empty files can't be mapped so they give empty bytes
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+class BlockLog(BlockStore):
+    """
+        Class represents the storage of the blocks in the chain by an append-only log of segment files in a directory
+        Appends are locked on the index file so several processes can share a log
+    """
+
+    def __init__(self, path: str, max_segment_size: int = 64 * 1024 * 1024):
+        self.path = path
+        self.max_segment_size = max_segment_size  # size in bytes a segment will not grow past, unless one record is
+        self.index_path = os.path.join(path, "index")
+        os.makedirs(path, exist_ok=True)
+        open(self.index_path, "ab").close()
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"segment-{segment:06d}.log")
+
+    @staticmethod
+    def read_entry(index: Union[bytes, mmap.mmap], position: int) -> Tuple[int, int, int]:
+        # Function reads the (block index, segment, offset) index entry at position
+        return index_entry_format.unpack_from(index, position * index_entry_format.size)
+
+    @staticmethod
+    def find_entry(index: Union[bytes, mmap.mmap], block_index: int) -> int:
+        # Function binary searches the index for the position of the first entry with a block index >= block_index
+        low, high = 0, len(index) // index_entry_format.size
+        while low < high:
+            middle = (low + high) // 2
+            if BlockLog.read_entry(index, middle)[0] < block_index:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @staticmethod
+    def read_record(segment: Union[bytes, mmap.mmap], offset: int) -> Tuple[dict, int]:
+        # Function reads the record at offset, returns the block and the offset of the next record
+        length, = record_length_format.unpack_from(segment, offset)
+        start = offset + record_length_format.size
+        return json.loads(segment[start:start + length]), start + length
+
+    def truncate_segment(self, segment: int, end: int):
+        # Function cuts off a segment at end, creating it if needed, returns the file to write from end
+        segment_file = os.fdopen(os.open(self.segment_path(segment), os.O_RDWR | os.O_CREAT), "r+b")
+        segment_file.truncate(end)
+        segment_file.seek(end)
+        return segment_file
+
+    def append(self, block_dict: dict, is_checkpoint: bool = False) -> None:
+        # Blocks already in the log are skipped, such as when another process appended them first
+        # Throws ValueError if the block would leave a gap, or another block is stored with its index
+        record = json.dumps(block_dict).encode("utf-8")
+
+        with open(self.index_path, "r+b") as index_file:
+            fcntl.flock(index_file, fcntl.LOCK_EX)
+            index_size = index_file.seek(0, os.SEEK_END)
+
+            # Cut off an index entry from an append that didn't finish, so the last entry is read whole
+            index_size -= index_size % index_entry_format.size
+            index_file.truncate(index_size)
+
+            # Find where the last record ends, anything after it is from an append that didn't finish
+            segment, end, last_index = 0, 0, -1
+            if index_size >= index_entry_format.size:
+                index_file.seek(index_size - index_entry_format.size)
+                last_index, segment, offset = index_entry_format.unpack(index_file.read(index_entry_format.size))
+                if block_dict["index"] <= last_index:
+                    stored_block = self.get_block(block_dict["index"])
+                    if stored_block is None or stored_block["hash"] != block_dict["hash"]:
+                        raise ValueError(f"Block {block_dict['index']} conflicts with the blocks stored in the log "
+                                         f"up to block {last_index}")
+                    return
+                with open(self.segment_path(segment), "rb") as segment_file:
+                    segment_file.seek(offset)
+                    length, = record_length_format.unpack(segment_file.read(record_length_format.size))
+                end = offset + record_length_format.size + length
+
+            if block_dict["index"] != last_index + 1 and not is_checkpoint:
+                raise ValueError(f"Block {block_dict['index']} does not follow on from block {last_index} in the log")
+
+            if end > 0 and end + record_length_format.size + len(record) > self.max_segment_size:
+                self.truncate_segment(segment, end).close()
+                segment, end = segment + 1, 0
+
+            # Write the record before its index entry, so the index only ever points to complete records
+            with self.truncate_segment(segment, end) as segment_file:
+                segment_file.write(record_length_format.pack(len(record)) + record)
+
+            index_file.seek(index_size)
+            index_file.write(index_entry_format.pack(block_dict["index"], segment, end))
+
+    def get_block(self, index: int) -> Union[None, dict]:
+        with map_file(self.index_path) as index_map:
+            position = self.find_entry(index_map, index)
+            if position * index_entry_format.size >= len(index_map):
+                return None
+            block_index, segment, offset = self.read_entry(index_map, position)
+        if block_index != index:
+            return None
+
+        with map_file(self.segment_path(segment)) as segment_map:
+            return self.read_record(segment_map, offset)[0]
+
+    def iter_blocks(self, start_index: int = 0, end_index: int = None) -> Iterator[dict]:
+        # The index is only used to find the first block, the rest are read in order through the segments
+        with map_file(self.index_path) as index_map:
+            num_entries = len(index_map) // index_entry_format.size
+            position = self.find_entry(index_map, start_index)
+            if position >= num_entries:
+                return
+            _, segment, offset = self.read_entry(index_map, position)
+            remaining = num_entries - position
+
+        while remaining > 0:
+            with map_file(self.segment_path(segment)) as segment_map:
+                while remaining > 0 and offset < len(segment_map):
+                    block_dict, offset = self.read_record(segment_map, offset)
+                    if end_index is not None and block_dict["index"] > end_index:
+                        return
+                    yield block_dict
+                    remaining -= 1
+            segment, offset = segment + 1, 0
+
+    def tip_index(self) -> int:
+        with map_file(self.index_path) as index_map:
+            num_entries = len(index_map) // index_entry_format.size
+            return self.read_entry(index_map, num_entries - 1)[0] if num_entries > 0 else -1
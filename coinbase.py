@@ -1,29 +1,182 @@
+import argparse
+import fcntl
+import hashlib
+import itertools
 import json
+import os
+import tempfile
 import uuid
 from typing import Union
 
+import click
 import cryptography.exceptions
 
-from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
-from flask import Flask, jsonify, request, render_template
+from flask import Blueprint, Flask, current_app, jsonify, request, render_template
+from flask.cli import with_appcontext
 from sqlalchemy import func
 
 import blockchain as crypto
-from blockchain import Transaction, BlockChain, CoinBase, Block, db
+import signatures
+import snapshot
+import sync
+from blockchain import Transaction, BlockChain, BlockStore, CoinBase, Block, AddressHistory, SQLBlockStore, db
+from admission import RecentSubmissions, SubmissionQueue
+from blocklog import BlockLog
+from cryptopool import CryptoPool, PoolFullError, PoolTimeoutError
+from signatures import PrivateKey, PublicKey
 
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///blockchain.sqlite3"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db.init_app(app)
+api = Blueprint("api", __name__)
 
 port = 5000
-blockchain = BlockChain()
-coinbase = CoinBase(None, None, "")  # is set in app.app_context()
+max_chain_range = 100  # maximum amount of blocks given for a range of the chain
+max_history_page = 50  # maximum amount of history entries given for a page of a wallet's history
+max_waiting_submissions = 32  # proofs of work waiting to be checked
+max_recent_submissions = 10000  # recent (block uuid, miner key, proof of work) submissions remembered
+submission_retry_after = 1  # seconds a miner is told to wait when too many proofs of work are waiting
+
+
+class Node:
+    """
+        Class represents the state of the node served by an app, kept in app.extensions["coinbase"] so that
+        apps created by create_app() don't share their chain, coinbase or worker pool
+    """
+
+    def __init__(self, block_store: BlockStore, crypto_pool: CryptoPool):
+        self.blockchain = BlockChain(block_store)
+        self.crypto_pool = crypto_pool  # runs key generation, signing and verifying off the request threads
+        self.submission_queue = SubmissionQueue(max_size=max_waiting_submissions)
+        self.recent_submissions = RecentSubmissions(max_size=max_recent_submissions)
+        self.coinbase: Union[None, CoinBase] = None  # is set by init_node() on the first request
+
+
+def get_node() -> Node:
+    # Function returns the state of the node served by the current app
+    return current_app.extensions["coinbase"]
+
+
+def init_lock_path(database_uri: str) -> str:
+    # Function returns the path of the file locked while setting up the database at database_uri, every process
+    # serving the same database on this machine locks the same file
+    name = hashlib.sha256(database_uri.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"easypycoin-{name}.lock")
+
+
+def create_app(database_uri: str = "sqlite:///blockchain.sqlite3", server_port: int = port,
+               block_log_path: str = None, crypto_workers: int = None) -> Flask:
+    # Application factory, creating the app is cheap as database setup and key generation are deferred to
+    # the first request, so multiple workers (e.g. gunicorn "coinbase:create_app()") can boot quickly
+    # The chain is read from the database, or from a block log at block_log_path if given
+    # Cryptography runs in a pool of crypto_workers processes, a process per CPU by default and none (inline) with 0
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_uri
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["COINBASE_PORT"] = server_port
+    app.config["COINBASE_INIT_LOCK"] = init_lock_path(database_uri)
+    block_store = BlockLog(block_log_path) if block_log_path is not None else SQLBlockStore()
+    crypto_pool = CryptoPool(crypto_workers) if crypto_workers is not None else CryptoPool()
+    app.extensions["coinbase"] = Node(block_store, crypto_pool)
+    db.init_app(app)
+    app.register_blueprint(api)
+    app.before_first_request(init_node)
+    app.cli.add_command(export_snapshot_command)
+    app.cli.add_command(import_snapshot_command)
+    app.cli.add_command(verify_snapshot_command)
+    app.cli.add_command(add_peer_command)
+    app.cli.add_command(sync_command)
+    app.cli.add_command(backfill_command)
+    return app
+
+
+def init_node() -> None:
+    # Function does the heavy startup work of this node, creating the tables, the genesis block and
+    # renewing (or generating the keys of) this server's coinbase. Must be called within an app context
+    # Workers serving the same database take turns, so only the first creates the genesis block and coinbase
+    node = get_node()
+    with open(current_app.config["COINBASE_INIT_LOCK"], "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        db.create_all()
+        node.blockchain.check_schema()
+        node.blockchain.check_genesis_block()
+        node.blockchain.sync_block_store()
+        node.blockchain.sync_address_history()
+        node.blockchain.load_mining_blocks()
+        node.coinbase = CoinBase.renew_coinbase(current_app.config["COINBASE_PORT"])
+
+
+"""
+Commands
+"""
+
+
+@click.command("export-snapshot")
+@click.argument("path")
+@with_appcontext
+def export_snapshot_command(path: str) -> None:
+    # Command writes a snapshot of this node's chain state, used to bootstrap other nodes
+    init_node()
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    click.echo(f"Wrote snapshot to {path}")
+
+
+@click.command("import-snapshot")
+@click.argument("path")
+@with_appcontext
+def import_snapshot_command(path: str) -> None:
+    # Command bootstraps this (new) node from a snapshot
+    init_node()
+    try:
+        snapshot.import_snapshot(path, get_node().blockchain.block_store)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Imported snapshot {path}")
+
+
+@click.command("verify-snapshot")
+@click.argument("path")
+@with_appcontext
+def verify_snapshot_command(path: str) -> None:
+    # Command checks the history stored on this node against a snapshot, e.g. once it has been back-filled from peers
+    init_node()
+    try:
+        error_msg = snapshot.verify_snapshot(path, get_node().blockchain.block_store)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if error_msg:
+        raise click.ClickException(error_msg)
+    click.echo("The chain and balances on this node match the snapshot")
+
+
+@click.command("add-peer")
+@click.argument("server")
+@with_appcontext
+def add_peer_command(server: str) -> None:
+    # Command adds the node running at server (e.g. http://127.0.0.1:5001) as a peer to sync with
+    init_node()
+    try:
+        sync.add_peer(server)
+    except (ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Added peer {server}")
+
+
+@click.command("sync")
+@with_appcontext
+def sync_command() -> None:
+    # Command fetches the blocks this node is missing from its peers
+    init_node()
+    for server, msg in sync.sync_with_peers(get_node().blockchain.block_store):
+        click.echo(f"{server}: {msg}")
+
+
+@click.command("backfill")
+@with_appcontext
+def backfill_command() -> None:
+    # Command fetches the history before the checkpoint of a node bootstrapped from a snapshot from its peers,
+    # checking it against the checkpoint's rolling hash
+    init_node()
+    server, msg = sync.backfill_with_peers()
+    click.echo(f"{server}: {msg}" if server else msg)
 
-with app.app_context():
-    db.create_all()
-    blockchain.check_genesis_block()
-    coinbase.renew_coinbase(port)
 
 """
 General Functions
@@ -61,8 +214,9 @@ def check_uuid(str_uuid: str) -> uuid:
     return uuidv4
 
 
-def check_public_key(key: str) -> RSAPublicKey:
-    # Function checks if a string representation of a RSA public key and returns said key otherwise throws ValueError
+def check_public_key(key: str) -> PublicKey:
+    # Function checks if a string representation of a public key (of any signature scheme) and returns said key
+    # otherwise throws ValueError
     try:
         return crypto.ascii_key_to_public_key(key)
     except ValueError:
@@ -71,8 +225,9 @@ def check_public_key(key: str) -> RSAPublicKey:
         raise ValueError(str(e))
 
 
-def check_private_key(key: str) -> RSAPrivateKey:
-    # Function checks if a string representation of a RSA public key and returns said key otherwise throws ValueError
+def check_private_key(key: str) -> PrivateKey:
+    # Function checks if a string representation of a private key (of any signature scheme) and returns said key
+    # otherwise throws ValueError
     try:
         return crypto.ascii_key_to_private_key(key)
     except ValueError:
@@ -85,8 +240,8 @@ class CheckTransReturn:
     # A storage container class just for transaction requests
     # Simply stores common information for transaction requests
 
-    def __init__(self, sender_public_key: RSAPublicKey, sender_private_key: Union[None, RSAPrivateKey],
-                 recipient_public_key: RSAPublicKey, amount: int, uuidv4: uuid.UUID, signature: str):
+    def __init__(self, sender_public_key: PublicKey, sender_private_key: Union[None, PrivateKey],
+                 recipient_public_key: PublicKey, amount: int, uuidv4: uuid.UUID, signature: str):
         self.sender_public_key = sender_public_key
         self.sender_private_key = sender_private_key
         self.recipient_public_key = recipient_public_key
@@ -129,16 +284,33 @@ Endpoints
 """
 
 
-@app.route("/")
+@api.errorhandler(PoolFullError)
+def crypto_pool_full(e: PoolFullError):
+    return str(e), 503, {"Retry-After": "1"}
+
+
+@api.errorhandler(PoolTimeoutError)
+def crypto_pool_timeout(e: PoolTimeoutError):
+    return "Cryptographic operation took too long", 504
+
+
+@api.route("/")
 def home():
     return render_template("index.html")
 
 
-@app.route("/api/wallet", methods=["GET"])
+@api.route("/api/wallet", methods=["GET"])
 def create_new_wallet():
-    # Endpoint creates a new wallet by providing returning a new public/private RSA key pair
+    # Endpoint creates a new wallet by providing returning a new public/private key pair
+    # The signature scheme of the keys can be chosen with the scheme query string, rsa by default
     # Note that typically in a coinbase, the coinbase wouldn't be doing this, but this provides the option
-    wallet = crypto.Wallet()
+    try:
+        scheme = signatures.get_scheme(request.args.get("scheme", signatures.default_scheme.name))
+    except ValueError as e:
+        return str(e), 400
+
+    wallet = crypto.Wallet(False)
+    wallet.private_key, wallet.public_key = get_node().crypto_pool.generate_keys(scheme)
     private_key, public_key = wallet.keys_to_ascii()
     response = {
         "private_key": private_key,
@@ -147,7 +319,7 @@ def create_new_wallet():
     return response
 
 
-@app.route("/api/wallet/balance", methods=["GET"])
+@api.route("/api/wallet/balance", methods=["GET"])
 def check_wallet_balance():
     # Endpoint determines a wallet's balance, given a public key
 
@@ -166,7 +338,33 @@ def check_wallet_balance():
     return str(CoinBase.get_key_balance(public_key)), 200
 
 
-@app.route("/api/transaction/sign", methods=["POST"])
+@api.route("/api/wallet/history", methods=["GET"])
+def get_wallet_history():
+    # Endpoint gives a page of a wallet's history in the chain, newest first, given a public key
+    # The next page is given by passing next_cursor as the cursor query string, it's null on the last page
+
+    # Query string checking
+    query_strings = request.args
+    if "public_key" not in query_strings:
+        return "Missing public key", 400
+
+    try:
+        public_key = check_public_key(query_strings["public_key"])
+        cursor = check_int(query_strings["cursor"]) if "cursor" in query_strings else None
+        limit = max_history_page
+        if "limit" in query_strings:
+            limit = min(check_int(query_strings["limit"]), max_history_page)
+    except ValueError as e:
+        return str(e), 400
+
+    history = AddressHistory.page(public_key, cursor, limit)
+    return json.dumps({
+        "history": [entry.to_ascii_dict() for entry in history],
+        "next_cursor": history[-1].id if len(history) == limit else None
+    }), 200
+
+
+@api.route("/api/transaction/sign", methods=["POST"])
 def sign_transaction():
     # Endpoint for allowing for signing a transaction
     # Similarly to gen wallets we provide the option, the coinbase should not really have these.
@@ -183,7 +381,7 @@ def sign_transaction():
                               json_post.recipient_public_key,
                               json_post.amount,
                               json_post.uuidv4)
-    transaction.sign()
+    transaction.sign(get_node().crypto_pool.sign)
 
     # Give back the transaction, but with the signature
     response = transaction.to_ascii_dict()
@@ -192,7 +390,7 @@ def sign_transaction():
     return jsonify(response), 200
 
 
-@app.route("/api/transaction", methods=["POST"])
+@api.route("/api/transaction", methods=["POST"])
 def generate_transaction():
     # Endpoint generates a new transaction and stores it on this node
 
@@ -211,11 +409,11 @@ def generate_transaction():
     transaction.signature = crypto.ascii_to_binary(json_post.signature)
 
     # ensure that the transaction is valid and then return
-    if not transaction.is_valid():
+    if not transaction.is_valid(get_node().crypto_pool.verify):
         return "Transaction Signature is not valid", 400
 
     # Does the user actually have enough for this?
-    if coinbase.get_key_balance(json_post.sender_public_key) - json_post.amount < 0:
+    if CoinBase.get_key_balance(json_post.sender_public_key) - json_post.amount < 0:
         return "Balance is not sufficient to do this transaction", 400
 
     db_commit_directly(transaction)
@@ -224,7 +422,7 @@ def generate_transaction():
     return json.dumps({'success': True}), 200, {'ContentType': 'application/json'}
 
 
-@app.route("/api/transaction/<uuid:transaction_uuid>", methods=["GET"])
+@api.route("/api/transaction/<uuid:transaction_uuid>", methods=["GET"])
 def get_transaction(transaction_uuid: uuid):
     # Endpoint finds a match for a given uuid and gives back the transaction
     trans = Transaction.query.filter_by(uuid=transaction_uuid).one_or_none()
@@ -233,20 +431,41 @@ def get_transaction(transaction_uuid: uuid):
     return json.dumps(trans, default=crypto.serializer), 200
 
 
-@app.route("/api/transactions", methods=["GET"])
+@api.route("/api/transaction/<uuid:transaction_uuid>/proof", methods=["GET"])
+def get_transaction_proof(transaction_uuid: uuid):
+    # Endpoint gives the merkle path proving a transaction is in a block of the chain, so it can be verified
+    # against the block's merkle root without the whole block
+    trans = Transaction.query.filter_by(uuid=transaction_uuid).one_or_none()
+    if trans is None:
+        return "{}", 200
+    if not trans.has_been_mined:
+        return "Transaction has not been mined into a block", 400
+
+    return json.dumps({
+        "uuid": trans.uuid,
+        "hash": trans.hash(),
+        "block_uuid": trans.block.uuid,
+        "block_index": trans.block.index,
+        "merkle_root": trans.block.merkle_root,
+        "path": [{"hash": sibling, "side": side} for sibling, side in trans.block.merkle_proof(trans)]
+    }, default=crypto.serializer), 200
+
+
+@api.route("/api/transactions", methods=["GET"])
 def get_transactions():
     # Endpoint GET returns all transaction in this coinbase
     return json.dumps(Transaction.query.filter_by(has_been_mined=False).all(), default=crypto.serializer), 200
 
 
-@app.route("/api/mine", methods=["GET", "POST"])
+@api.route("/api/mine", methods=["GET", "POST"])
 def mine():
     # Endpoint GET returns all minable blocks that the client is able to mine
     # Endpoint POST expects a block in binary in form [miner's public key]|[block's mining input]|[proof of work]
     # and adds it to the blockchain
 
+    node = get_node()
     if request.method == "GET":
-        blockchain.create_mining_blocks()  # Create mining blocks if needed
+        node.blockchain.create_mining_blocks()  # Create mining blocks if needed
         # Give the mining blocks in the mining input format
         return json.dumps(
             {"blocks": [{"uuid": block.uuid,
@@ -260,30 +479,53 @@ def mine():
     try:
         proof_of_work = check_int(request.json["proof_of_work"])
         block_uuid = check_uuid(request.json["uuid"])
-        check_public_key(miner_public_key)
+        # The key is hashed as sent but stored as a key, so only its own form can give the same hash once stored
+        if crypto.public_key_to_ascii_key(check_public_key(miner_public_key)) != miner_public_key:
+            raise ValueError("Miner's public key must be given in lowercase hexadecimal, as given by /api/wallet")
     except ValueError as e:
         return str(e), 400
 
     if [None, ""] in [block_uuid, miner_public_key, proof_of_work]:
         return "Missing POST values", 400
 
-    # Find the block the miner specified
-    error_find_block_msg, fatal_error, block = blockchain.find_mine_block(block_uuid)
+    # Cheap checks first, turn away the same proof being sent again and blocks known to no longer be minable
+    submission = (block_uuid, miner_public_key, proof_of_work)
+    if not node.recent_submissions.add(submission):
+        return "This proof of work has already been submitted", 409
+
+    # A submission that wasn't checked, as it was turned away or the check failed, is forgotten so it can be sent again
+    try:
+        error_precheck_msg = node.blockchain.precheck_mine_block(block_uuid)
+        if error_precheck_msg:
+            return error_precheck_msg, 401
+
+        # Proofs are checked one at a time as only one can win, miners are told to come back when too many are waiting
+        with node.submission_queue.admit() as admitted:
+            if not admitted:
+                node.recent_submissions.remove(submission)
+                return "Too many proofs of work are waiting to be checked, try again later", 429, \
+                       {"Retry-After": str(submission_retry_after)}
 
-    if block is None:
-        return error_find_block_msg, 400 if fatal_error else 401
+            # Find the block the miner specified
+            error_find_block_msg, fatal_error, block = node.blockchain.find_mine_block(block_uuid)
 
-    # Try this proof of work the miner sent and see if this works
-    error_proof_msg = block.check_proof_of_work(proof_of_work, miner_public_key)
+            if block is None:
+                return error_find_block_msg, 400 if fatal_error else 401
 
-    if error_proof_msg:
-        return error_proof_msg, 400
+            # Try this proof of work the miner sent and see if this works
+            error_proof_msg = block.check_proof_of_work(proof_of_work, miner_public_key, node.crypto_pool.verify_many)
 
-    # Checks out, now we need to add the transaction to the blockchain and remove it from minable block
-    blockchain.move_minable_block(block)
+            if error_proof_msg:
+                return error_proof_msg, 400
 
-    # We have to regenerate the mining blocks now, the previous block hash is now this one
-    blockchain.clear_mining_blocks()
+            # Checks out, now we need to add the transaction to the blockchain and remove it from minable block
+            node.blockchain.move_minable_block(block)
+
+            # We have to regenerate the mining blocks now, the previous block hash is now this one
+            node.blockchain.clear_mining_blocks()
+    except Exception:
+        node.recent_submissions.remove(submission)
+        raise
 
     # Lastly, reward the miner!
     # This is actually implicit, since the block is in the chain, the coinbase logged the user of mining that block,
@@ -292,21 +534,22 @@ def mine():
     return f"Miner received {crypto.block_mining_reward} coins for Block UUID {block_uuid}", 200
 
 
-@app.route("/api/mine/numzeros", methods=["GET"])
+@api.route("/api/mine/numzeros", methods=["GET"])
 def give_number_of_zeros():
     # Endpoint returns the number of zeros of a mining block's SHA256 hash that must be at the start for it to count as
     # a valid proof of work
     return str(crypto.num_of_zeros), 200
 
 
-@app.route("/api/chain", methods=["GET"])
+@api.route("/api/chain", methods=["GET"])
 def get_chain():
     # Endpoint returns the blocks in the blockchain
 
     # Support for filtering with query strings
     # Parse and put the query strings into variables
     query_strings = request.args
-    miner_key = block_index = block_uuid = None
+    miner_key = block_index = block_uuid = start_index = None
+    count = max_chain_range
 
     try:
         if "miner_key" in query_strings:
@@ -317,9 +560,23 @@ def get_chain():
 
         if "block_uuid" in query_strings:
             block_uuid = check_uuid(query_strings["block_uuid"])
+
+        # A range of blocks, as fetched by peers syncing with this node
+        if "start_index" in query_strings:
+            start_index = check_int(query_strings["start_index"], lower_bound_check=False)
+
+        if "count" in query_strings:
+            count = min(check_int(query_strings["count"]), max_chain_range)
     except ValueError as e:
         return str(e), 400
 
+    # The whole chain or a range of it is read straight from the block store
+    if miner_key is None and block_index is None and block_uuid is None:
+        chain = get_node().blockchain.block_store.iter_blocks(start_index if start_index is not None else 0)
+        if start_index is not None:
+            chain = itertools.islice(chain, count)
+        return json.dumps({"blocks": list(chain)}), 200
+
     # Now apply all filters onto the query, if supplied
     chain = Block.query.filter_by(is_mining_block=False)
     if miner_key is not None:
@@ -331,24 +588,30 @@ def get_chain():
             chain = chain.filter_by(index=block_index)
     if block_uuid is not None:
         chain = chain.filter_by(uuid=block_uuid)
+    if start_index is not None:
+        chain = chain.filter(Block.index >= start_index).order_by(Block.index).limit(count)
 
     chain = chain.all()
-    return json.dumps({
-        "blocks":
-            [{
-                "index": block.index,
-                "uuid": block.uuid,
-                "hash": block.block_hash,
-                "proof_of_work": block.proof_of_work,
-                "previous_hash": block.previous_block_hash,
-                "miner_key": crypto.public_key_to_ascii_key(block.miner_key) if block.miner_key is not None else "",
-                "transactions": [trans.to_ascii_dict(include_signature=True) for trans in block.transactions]
-            }
-                for block in chain]
-    }, default=crypto.serializer), 200
+    return json.dumps({"blocks": [block.to_chain_dict() for block in chain]}, default=crypto.serializer), 200
+
+
+@api.route("/api/pool", methods=["GET"])
+def get_crypto_pool_metrics():
+    # Endpoint returns how much the pool running this node's cryptography is being used
+    return get_node().crypto_pool.metrics()
+
+
+@api.route("/api/coinbase", methods=["GET"])
+def get_coinbase():
+    # Endpoint returns this node's coinbase, used by other nodes to add this node as a peer
+    coinbase = get_node().coinbase
+    return {
+        "public_key": crypto.public_key_to_ascii_key(coinbase.public_key),
+        "server": coinbase.server
+    }
 
 
-@app.route("/api/buy", methods=["POST"])
+@api.route("/api/buy", methods=["POST"])
 def buy_coins():
     # Endpoint gives (free) coins to the user
 
@@ -367,11 +630,19 @@ def buy_coins():
         return str(e), 400
 
     # Create a brand new transaction
-    coinbase.give_key_coins(public_key, amount)
+    node = get_node()
+    node.coinbase.give_key_coins(public_key, amount, node.crypto_pool.sign)
     ascii_key = crypto.public_key_to_ascii_key(public_key)
     msg_key = (ascii_key[:50] + '..') if len(ascii_key) > 50 else ascii_key
     return f"{msg_key} received {amount} coins", 200
 
 
 if __name__ == '__main__':
-    app.run(debug=True, port=port)
+    # Several nodes can be run locally by giving each its own port and database
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--database", default="sqlite:///blockchain.sqlite3")
+    parser.add_argument("--block-log", default=None, help="directory of a block log to read the chain from")
+    parser.add_argument("--crypto-workers", type=int, default=None, help="processes to run cryptography in")
+    args = parser.parse_args()
+    create_app(args.database, args.port, args.block_log, args.crypto_workers).run(debug=True, port=args.port)
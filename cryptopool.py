@@ -0,0 +1,155 @@
+import concurrent.futures
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List, Tuple
+
+import signatures
+from signatures import PrivateKey, PublicKey, SignatureScheme
+
+# A pool of processes for the CPU bound cryptography (key generation, signing and verifying), so a slow request
+# doesn't hold up the others. Keys can't be pickled, so they are sent to the worker processes in their bytes
+
+
+class PoolFullError(RuntimeError):
+    """Error for when too many tasks are waiting on the crypto pool"""
+
+
+class PoolTimeoutError(RuntimeError):
+    """Error for when tasks in the crypto pool take too long to finish"""
+
+
+def timed_call(function: Callable, *args) -> Tuple[object, float]:
+    # Function calls function in a worker process, returns its result and how long it took in seconds
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def generate_keys_task(scheme_name: str) -> Tuple[bytes, bytes]:
+    private_key = signatures.get_scheme(scheme_name).generate_private_key()
+    return signatures.private_key_to_bytes(private_key), signatures.public_key_to_bytes(private_key.public_key())
+
+
+def sign_task(private_key: bytes, message: bytes) -> bytes:
+    return signatures.sign(signatures.load_private_key(private_key), message)
+
+
+def verify_task(public_key: bytes, signature: bytes, message: bytes) -> bool:
+    return signatures.verify(signatures.load_public_key(public_key), signature, message)
+
+
+class CryptoPool:
+    """
+        Class represents a pool of processes to run cryptography in, with at most max_pending tasks waiting or running
+        Tasks taking longer than timeout seconds to finish throw PoolTimeoutError
+        With max_workers as 0 the tasks are run in the calling thread instead
+    """
+
+    def __init__(self, max_workers: int = os.cpu_count(), max_pending: int = 64, timeout: float = 10):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.executor = None  # started on first use, so creating the app stays fast
+        self.executor_lock = threading.Lock()
+        self.metrics_lock = threading.Lock()
+        self.started_time = time.monotonic()
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.busy_seconds = 0.0  # time the worker processes spent running tasks
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.max_workers)
+                self.started_time = time.monotonic()
+            return self.executor
+
+    def task_done(self, future: concurrent.futures.Future) -> None:
+        # Function frees up the task's place in the pool once it's finished, even if it was waited on for too long
+        with self.metrics_lock:
+            self.pending -= 1
+            if not future.cancelled() and future.exception() is None:
+                self.completed += 1
+                self.busy_seconds += future.result()[1]
+
+    def run(self, function: Callable, *args):
+        # Function runs function with args in the pool and waits for its result
+        # Throws PoolFullError if too many tasks are waiting, PoolTimeoutError if it takes too long
+        return self.run_many(function, [args])[0]
+
+    def run_many(self, function: Callable, args_list: Iterable[tuple]) -> list:
+        # Function runs function with each of args_list in the pool at once and waits for all their results
+        # The tasks are admitted together and share one timeout, throws the same as run()
+        args_list = list(args_list)
+        if self.max_workers == 0:
+            return [function(*args) for args in args_list]
+
+        with self.metrics_lock:
+            if self.pending + len(args_list) > self.max_pending:
+                self.rejected += 1
+                raise PoolFullError("Too many cryptographic operations are waiting, try again later")
+            self.pending += len(args_list)
+            self.submitted += len(args_list)
+
+        futures = []
+        try:
+            executor = self.get_executor()
+            for args in args_list:
+                futures.append(executor.submit(timed_call, function, *args))
+                futures[-1].add_done_callback(self.task_done)
+        except Exception:
+            # Tasks that were submitted free up their places when they finish, the rest never took them
+            for future in futures:
+                future.cancel()
+            with self.metrics_lock:
+                self.pending -= len(args_list) - len(futures)
+            raise
+
+        _, not_done = concurrent.futures.wait(futures, timeout=self.timeout)
+        if not_done:
+            for future in not_done:
+                future.cancel()
+            with self.metrics_lock:
+                self.timed_out += len(not_done)
+            raise PoolTimeoutError(f"Cryptographic operations took longer than {self.timeout} seconds")
+        return [future.result()[0] for future in futures]
+
+    def generate_keys(self, scheme: SignatureScheme) -> Tuple[PrivateKey, PublicKey]:
+        # Function generates a (private key, public key) pair of scheme in the pool
+        private_key, public_key = self.run(generate_keys_task, scheme.name)
+        return signatures.load_private_key(private_key), signatures.load_public_key(public_key)
+
+    def sign(self, private_key: PrivateKey, message: bytes) -> bytes:
+        # Function signs message in the pool, same as signatures.sign()
+        return self.run(sign_task, signatures.private_key_to_bytes(private_key), message)
+
+    def verify(self, public_key: PublicKey, signature: bytes, message: bytes) -> bool:
+        # Function checks a signature in the pool, same as signatures.verify()
+        return self.run(verify_task, signatures.public_key_to_bytes(public_key), signature, message)
+
+    def verify_many(self, signed: List[Tuple[PublicKey, bytes, bytes]]) -> List[bool]:
+        # Function checks several signatures in the pool at once, same as signatures.verify_many()
+        return self.run_many(verify_task, [(signatures.public_key_to_bytes(public_key), signature, message)
+                                           for public_key, signature, message in signed])
+
+    def metrics(self) -> dict:
+        # Function returns how much the pool is being used, utilization is the share of the workers' time spent busy
+        with self.metrics_lock:
+            uptime = time.monotonic() - self.started_time
+            capacity = uptime * self.max_workers
+            return {
+                "workers": self.max_workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "busy_seconds": self.busy_seconds,
+                "utilization": self.busy_seconds / capacity if capacity > 0 else 0.0
+            }
@@ -2,9 +2,8 @@ import binascii
 import uuid
 
 import sqlalchemy.types as types
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.serialization import PrivateFormat, NoEncryption
-from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+import signatures
 
 
 # https://stackoverflow.com/questions/28143557/sqlalchemy-convert-column-value-back-and-forth-between-internal-and-database-fo
@@ -25,12 +24,12 @@ class KeyModel(types.TypeDecorator):
             # For simplicity when mining, the public key is allowed to be a string so the miner simply has to put
             # the ascii encoding of the key instead of the actual byte version occurs under POST /api/mine
             if self.is_private_key:
-                value = serialization.load_der_private_key(binascii.unhexlify(value), None)
+                value = signatures.load_private_key(binascii.unhexlify(value))
             else:
-                value = serialization.load_der_public_key(binascii.unhexlify(value))
+                value = signatures.load_public_key(binascii.unhexlify(value))
         if self.is_private_key:
-            return value.private_bytes(Encoding.DER, PrivateFormat.PKCS8, NoEncryption())
-        return value.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+            return signatures.private_key_to_bytes(value)
+        return signatures.public_key_to_bytes(value)
 
     process_bind_param = process_literal_param
 
@@ -38,8 +37,8 @@ class KeyModel(types.TypeDecorator):
         if value == b"0":
             return None
         if self.is_private_key:
-            return serialization.load_der_private_key(value, None)
-        return serialization.load_der_public_key(value)
+            return signatures.load_private_key(value)
+        return signatures.load_public_key(value)
 
 
 class UUIDModel(types.TypeDecorator):
@@ -0,0 +1,167 @@
+from abc import ABC, abstractmethod
+from typing import Callable, List, Tuple, Union
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
+from cryptography.hazmat.primitives.serialization import Encoding, PrivateFormat, PublicFormat, NoEncryption
+
+# Keys are tagged with the signature scheme they are for, the scheme of a signature is that of the signer's key
+# RSA keys are kept in DER, which always begins with 0x30, so keys from before schemes were tagged still load
+# Ed25519 keys are the ed25519_tag byte followed by the raw key, as DER would add 12 bytes to a 32 byte key
+
+PublicKey = Union[RSAPublicKey, Ed25519PublicKey]
+PrivateKey = Union[RSAPrivateKey, Ed25519PrivateKey]
+Signer = Callable[[PrivateKey, bytes], bytes]  # sign() or an equivalent
+Verifier = Callable[[PublicKey, bytes, bytes], bool]  # verify() or an equivalent
+BatchVerifier = Callable[[List[Tuple[PublicKey, bytes, bytes]]], List[bool]]  # verify_many() or an equivalent
+
+ed25519_tag = b"\xed"
+
+
+class SignatureScheme(ABC):
+    """Class represents a signature scheme, how its keys are generated and serialized and how it signs"""
+
+    name = ""
+
+    @abstractmethod
+    def generate_private_key(self) -> PrivateKey:
+        pass
+
+    @abstractmethod
+    def sign(self, private_key: PrivateKey, message: bytes) -> bytes:
+        pass
+
+    @abstractmethod
+    def verify(self, public_key: PublicKey, signature: bytes, message: bytes) -> bool:
+        pass
+
+    @abstractmethod
+    def public_key_to_bytes(self, public_key: PublicKey) -> bytes:
+        pass
+
+    @abstractmethod
+    def private_key_to_bytes(self, private_key: PrivateKey) -> bytes:
+        pass
+
+
+class RSAScheme(SignatureScheme):
+    """Class represents RSA-PSS signatures with MGF1-SHA256, with DER keys"""
+
+    name = "rsa"
+    key_size = 512
+
+    def generate_private_key(self) -> RSAPrivateKey:
+        return rsa.generate_private_key(public_exponent=65537, key_size=self.key_size)
+
+    @staticmethod
+    def pss_padding() -> padding.PSS:
+        return padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
+
+    def sign(self, private_key: RSAPrivateKey, message: bytes) -> bytes:
+        return private_key.sign(message, self.pss_padding(), hashes.SHA256())
+
+    def verify(self, public_key: RSAPublicKey, signature: bytes, message: bytes) -> bool:
+        try:
+            public_key.verify(signature, message, self.pss_padding(), hashes.SHA256())
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_key_to_bytes(self, public_key: RSAPublicKey) -> bytes:
+        return public_key.public_bytes(Encoding.DER, PublicFormat.SubjectPublicKeyInfo)
+
+    def private_key_to_bytes(self, private_key: RSAPrivateKey) -> bytes:
+        return private_key.private_bytes(Encoding.DER, PrivateFormat.PKCS8, NoEncryption())
+
+
+class Ed25519Scheme(SignatureScheme):
+    """Class represents Ed25519 signatures, with tagged raw keys"""
+
+    name = "ed25519"
+
+    def generate_private_key(self) -> Ed25519PrivateKey:
+        return Ed25519PrivateKey.generate()
+
+    def sign(self, private_key: Ed25519PrivateKey, message: bytes) -> bytes:
+        return private_key.sign(message)
+
+    def verify(self, public_key: Ed25519PublicKey, signature: bytes, message: bytes) -> bool:
+        try:
+            public_key.verify(signature, message)
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_key_to_bytes(self, public_key: Ed25519PublicKey) -> bytes:
+        return ed25519_tag + public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+
+    def private_key_to_bytes(self, private_key: Ed25519PrivateKey) -> bytes:
+        return ed25519_tag + private_key.private_bytes(Encoding.Raw, PrivateFormat.Raw, NoEncryption())
+
+
+schemes = {scheme.name: scheme for scheme in [RSAScheme(), Ed25519Scheme()]}
+default_scheme = schemes["rsa"]
+
+
+def get_scheme(name: str) -> SignatureScheme:
+    # Function returns the signature scheme with this name, throws ValueError if there isn't one
+    if name not in schemes:
+        raise ValueError(f"Unknown signature scheme {name}, expected one of {', '.join(schemes)}")
+    return schemes[name]
+
+
+def scheme_of(key: Union[PublicKey, PrivateKey]) -> SignatureScheme:
+    # Function returns the signature scheme a public or private key is for
+    if isinstance(key, (Ed25519PublicKey, Ed25519PrivateKey)):
+        return schemes["ed25519"]
+    if isinstance(key, (RSAPublicKey, RSAPrivateKey)):
+        return schemes["rsa"]
+    raise TypeError(f"Keys of type {type(key).__name__} are not supported")
+
+
+def sign(private_key: PrivateKey, message: bytes) -> bytes:
+    # Function signs message with the scheme of the private key
+    return scheme_of(private_key).sign(private_key, message)
+
+
+def verify(public_key: PublicKey, signature: bytes, message: bytes) -> bool:
+    # Function checks if signature was made for message by the private key of public_key
+    return scheme_of(public_key).verify(public_key, signature, message)
+
+
+def verify_many(signed: List[Tuple[PublicKey, bytes, bytes]]) -> List[bool]:
+    # Function checks several (public key, signature, message) at once, returns if each is valid
+    return [verify(public_key, signature, message) for public_key, signature, message in signed]
+
+
+def public_key_to_bytes(public_key: PublicKey) -> bytes:
+    # Function converts a public key to its scheme tagged bytes
+    return scheme_of(public_key).public_key_to_bytes(public_key)
+
+
+def private_key_to_bytes(private_key: PrivateKey) -> bytes:
+    # Function converts a private key to its scheme tagged bytes
+    return scheme_of(private_key).private_key_to_bytes(private_key)
+
+
+def load_public_key(key: bytes) -> PublicKey:
+    # Function loads a public key from its scheme tagged bytes, throws ValueError if it can't be loaded
+    # and TypeError if it's for an unsupported scheme
+    if key[:1] == ed25519_tag:
+        return Ed25519PublicKey.from_public_bytes(key[1:])
+    public_key = serialization.load_der_public_key(key)
+    scheme_of(public_key)
+    return public_key
+
+
+def load_private_key(key: bytes, password: bytes = None) -> PrivateKey:
+    # Function loads a private key from its scheme tagged bytes, throws ValueError if it can't be loaded
+    # and TypeError if it's for an unsupported scheme
+    if key[:1] == ed25519_tag:
+        return Ed25519PrivateKey.from_private_bytes(key[1:])
+    private_key = serialization.load_der_private_key(key, password)
+    scheme_of(private_key)
+    return private_key
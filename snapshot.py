@@ -0,0 +1,235 @@
+import hashlib
+import itertools
+import json
+import mmap
+import os
+import struct
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, Tuple
+
+import blockchain as crypto
+import signatures
+from blockchain import AddressHistory, Block, BlockChain, BlockStore, Checkpoint, CheckpointBalance, SQLBlockStore, db
+
+# A snapshot is a compact file of the chain state used to bootstrap a new node without replaying the chain:
+# [header][tip block record][balance records][sha256 of everything before]
+# header: magic, tip index, rolling hash of the chain up to the tip, rolling hash of the chain before the tip,
+#         tip record length, number of balances
+# tip block record: the json of the tip block, so new blocks can be chained onto it
+# balance record: [public key length][public key][balance], keys are in the bytes of signatures.public_key_to_bytes()
+# The history before the tip can later be back-filled from peers (see sync.backfill_with_peer()) and checked against
+# the rolling hash, and the balances worked out again from it
+
+snapshot_magic = b"EPCSNAP\x02"
+header_format = struct.Struct(">8sQ32s32sII")
+key_length_format = struct.Struct(">H")
+balance_format = struct.Struct(">q")
+checksum_size = hashlib.sha256().digest_size
+
+
+def chain_digests(block_hashes: Iterable[str], start_digests: Tuple[bytes, bytes] = (bytes(32), bytes(32))) \
+        -> Tuple[bytes, bytes]:
+    # Function computes the rolling hash of a chain, given its block hashes in index order, continuing on from
+    # start_digests. Each step is sha256(previous digest + block hash), so the digest commits to the whole history
+    # Returns the (digest before the last block, digest)
+    previous_digest, digest = start_digests
+    for block_hash in block_hashes:
+        previous_digest, digest = digest, hashlib.sha256(digest + bytes.fromhex(block_hash)).digest()
+    return previous_digest, digest
+
+
+def current_chain_digests(block_store: BlockStore, up_to_index: int) -> Tuple[bytes, bytes]:
+    # Function computes the rolling hash of the chain stored on this node, continuing from the checkpoint if any
+    checkpoint = BlockChain.checkpoint()
+    if checkpoint is None:
+        start_index, start_digests = 0, (bytes(32), bytes(32))
+    else:
+        start_index = checkpoint.index + 1
+        start_digests = bytes.fromhex(checkpoint.previous_chain_hash), bytes.fromhex(checkpoint.chain_hash)
+    chain = block_store.iter_blocks(start_index, up_to_index)
+    return chain_digests((block_dict["hash"] for block_dict in chain), start_digests)
+
+
+def history_blocks(block_store: BlockStore, up_to_index: int) -> Iterator[dict]:
+    # Function gives every block stored on this node up to up_to_index, in index order
+    # History up to the checkpoint is only in the database, once back-filled
+    # Throws ValueError if any of the blocks are missing
+    checkpoint = BlockChain.checkpoint()
+    if checkpoint is None:
+        chain = block_store.iter_blocks(0, up_to_index)
+    else:
+        chain = itertools.chain(SQLBlockStore().iter_blocks(0, min(checkpoint.index, up_to_index)),
+                                block_store.iter_blocks(checkpoint.index + 1, up_to_index))
+
+    expected_index = 0
+    for block_dict in chain:
+        if block_dict["index"] != expected_index:
+            break
+        yield block_dict
+        expected_index += 1
+    if expected_index != up_to_index + 1:
+        raise ValueError(f"Block {expected_index} is missing from this node, back-fill the history from a peer first")
+
+
+def checkpoint_balances() -> Dict[bytes, int]:
+    # Function gives the balances this node was bootstrapped with, keyed by public key bytes
+    return {signatures.public_key_to_bytes(checkpoint_balance.public_key): checkpoint_balance.balance
+            for checkpoint_balance in CheckpointBalance.query.all()}
+
+
+def add_block_balances(balances: Dict[bytes, int], block_dict: dict) -> None:
+    # Function adds the changes in balance of a block in the chain to balances
+    if block_dict["miner_key"]:
+        balances[crypto.ascii_to_binary(block_dict["miner_key"])] += crypto.block_mining_reward
+    for trans_dict in block_dict["transactions"]:
+        balances[crypto.ascii_to_binary(trans_dict["recipient_public_key"])] += trans_dict["amount"]
+        balances[crypto.ascii_to_binary(trans_dict["sender_public_key"])] -= trans_dict["amount"]
+
+
+def balance_table(block_store: BlockStore) -> Dict[bytes, int]:
+    # Function computes the balance of every key in a single pass over the chain, keyed by public key bytes
+    checkpoint = BlockChain.checkpoint()
+    checkpoint_index = checkpoint.index if checkpoint is not None else -1
+
+    balances = defaultdict(int, checkpoint_balances())
+    for block_dict in block_store.iter_blocks(checkpoint_index + 1):
+        add_block_balances(balances, block_dict)
+    return balances
+
+
+def held_balances(balances: Dict[bytes, int]) -> Dict[bytes, int]:
+    # Function leaves out the keys with no balance, which a table may or may not list
+    return {public_key: balance for public_key, balance in balances.items() if balance != 0}
+
+
+def history_balances(block_store: BlockStore, up_to_index: int) -> Dict[bytes, int]:
+    # Function works out the balances up to up_to_index from the blocks stored on this node alone
+    # Throws ValueError if any of the blocks are missing
+    balances = defaultdict(int)
+    for block_dict in history_blocks(block_store, up_to_index):
+        add_block_balances(balances, block_dict)
+    return held_balances(balances)
+
+
+def record_to_block(record: bytes) -> Block:
+    # Function recreates a block in the chain from its json record
+    return Block.from_chain_dict(json.loads(record.decode("utf-8")))
+
+
+def export_snapshot(path: str, block_store: BlockStore) -> None:
+    # Function writes a snapshot of this node's chain state to path
+    # Records are streamed to a temporary file that only replaces path once it is complete
+    tip_index = block_store.tip_index()
+    tip_record = json.dumps(block_store.get_block(tip_index)).encode("utf-8")
+    balances = balance_table(block_store)
+    checksum = hashlib.sha256()
+
+    temp_path = f"{path}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            def write(data: bytes) -> None:
+                checksum.update(data)
+                file.write(data)
+
+            previous_digest, digest = current_chain_digests(block_store, tip_index)
+            write(header_format.pack(snapshot_magic, tip_index, digest, previous_digest, len(tip_record),
+                                     len(balances)))
+            write(tip_record)
+            for public_key, balance in balances.items():
+                write(key_length_format.pack(len(public_key)))
+                write(public_key)
+                write(balance_format.pack(balance))
+            file.write(checksum.digest())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def read_snapshot(path: str) -> Tuple[int, bytes, bytes, Block, Dict[bytes, int]]:
+    # Function reads a snapshot with a memory map, returning the tip index, chain digest, chain digest before the tip,
+    # tip block and balances. Throws ValueError if the file isn't a snapshot, is corrupted or its tip doesn't match
+    # its chain digest
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as snapshot:
+        if len(snapshot) < header_format.size + checksum_size:
+            raise ValueError("Snapshot is too short")
+
+        # The body is hashed through a view of the map rather than a copy of it
+        body_end = len(snapshot) - checksum_size
+        with memoryview(snapshot) as view, view[:body_end] as body:
+            checksum = hashlib.sha256(body).digest()
+        if checksum != snapshot[body_end:]:
+            raise ValueError("Snapshot checksum does not match, the file is corrupted")
+
+        magic, tip_index, digest, previous_digest, tip_length, num_balances = header_format.unpack_from(snapshot, 0)
+        if magic != snapshot_magic:
+            raise ValueError("File is not a snapshot")
+
+        offset = header_format.size
+        try:
+            tip = record_to_block(snapshot[offset:offset + tip_length])
+        except (KeyError, ValueError) as e:
+            raise ValueError(f"Snapshot's tip block is invalid: {e}")
+        offset += tip_length
+
+        if tip.index != tip_index:
+            raise ValueError(f"Snapshot's tip block has index {tip.index}, expected {tip_index}")
+        if tip_index > 0 and tip.block_hash != tip.hash(include_proof_of_work=True, include_miner_key=True):
+            raise ValueError("Snapshot's tip block does not match its hash")
+        if chain_digests([tip.block_hash], (bytes(32), previous_digest))[1] != digest:
+            raise ValueError("Snapshot's tip block is not the last block of its chain hash")
+
+        balances = {}
+        for _ in range(num_balances):
+            key_length, = key_length_format.unpack_from(snapshot, offset)
+            offset += key_length_format.size
+            public_key = snapshot[offset:offset + key_length]
+            offset += key_length
+            balances[public_key], = balance_format.unpack_from(snapshot, offset)
+            offset += balance_format.size
+
+        if offset != body_end:
+            raise ValueError("Snapshot has trailing data")
+
+    return tip_index, digest, previous_digest, tip, balances
+
+
+def import_snapshot(path: str, block_store: BlockStore) -> None:
+    # Function bootstraps this node from a snapshot, the node must not have any blocks other than the genesis block
+    # The history before the tip can later be back-filled from peers and checked against the snapshot
+    if BlockChain.checkpoint() is not None or block_store.tip_index() > 0:
+        raise RuntimeError("A snapshot can only be imported into a node with no blocks other than the genesis block")
+
+    tip_index, digest, previous_digest, tip, balances = read_snapshot(path)
+    if tip_index == 0:
+        raise ValueError("Snapshot only holds the genesis block, there is nothing to import")
+
+    db.session.add(Checkpoint(tip_index, digest.hex(), previous_digest.hex()))
+    for public_key, balance in balances.items():
+        db.session.add(CheckpointBalance(signatures.load_public_key(public_key), balance))
+    tip_dict = tip.to_chain_dict()
+    db.session.add(tip)
+    db.session.add_all(AddressHistory.from_block(tip_dict))
+    db.session.commit()
+    block_store.append(tip_dict, is_checkpoint=True)
+
+
+def verify_snapshot(path: str, block_store: BlockStore) -> str:
+    # Function checks that the whole chain stored on this node up to the snapshot's tip matches the snapshot's rolling
+    # hash, and that the snapshot's balances and those this node was bootstrapped with are the ones worked out from
+    # that chain. Returns an error message - empty string if they all match
+    # Throws ValueError if the snapshot can't be read or blocks up to its tip are missing from this node
+    tip_index, digest, _, _, balances = read_snapshot(path)
+    block_hashes = (block_dict["hash"] for block_dict in history_blocks(block_store, tip_index))
+    if chain_digests(block_hashes)[1] != digest:
+        return "The chain on this node does not match the snapshot"
+
+    if history_balances(block_store, tip_index) != held_balances(balances):
+        return "The balances of the snapshot do not match its chain"
+
+    checkpoint = BlockChain.checkpoint()
+    if checkpoint is not None and \
+            history_balances(block_store, checkpoint.index) != held_balances(checkpoint_balances()):
+        return "The balances this node was bootstrapped with do not match its chain"
+    return ""
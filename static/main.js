@@ -195,8 +195,8 @@ async function mineBlock(jsonBlock, miner_public_key) {
         },
         error: function (jqxhr) {
             ++miningStats.miningAttempts;
-            // Stop mining on fatal errors
-            if (jqxhr["status"] !== 401)
+            // Stop mining on fatal errors, stale or duplicate blocks and a busy server are not fatal
+            if (![401, 409, 429].includes(jqxhr["status"]))
                 miningStats.doMine = false;
 
             $("#mine-status").html(`Successfully Mined ${miningStats.minedBlocks}/${miningStats.miningAttempts} block attempts`);
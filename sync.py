@@ -0,0 +1,238 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import blockchain as crypto
+import signatures
+import snapshot
+from blockchain import AddressHistory, Block, BlockChain, BlockStore, CoinBase, Transaction, db
+
+# Syncing fetches the blocks a node is missing from a peer in batches of block ranges, with several batches in flight
+# at once over a pooled session. The blocks are then verified in parallel, their transactions are checked against this
+# node's chain and they are added to the chain in one transaction
+
+batch_size = 50  # amount of blocks fetched per request, a node gives at most coinbase.max_chain_range
+max_pipelined_batches = 4  # amount of batches requested from a peer at once
+verify_workers = 4  # amount of threads verifying blocks, signature checks release the GIL
+request_timeout = 10  # seconds
+max_query_uuids = 500  # amount of transaction uuids looked up per query
+
+
+def create_session() -> requests.Session:
+    # Function creates a session that keeps a connection open per pipelined batch
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=max_pipelined_batches)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_chain(session: requests.Session, server: str, params: dict) -> List[dict]:
+    # Function fetches blocks of the chain from the node at server, filtered by params of GET /api/chain
+    response = session.get(f"{server}/api/chain", params=params, timeout=request_timeout)
+    response.raise_for_status()
+    return response.json()["blocks"]
+
+
+def fetch_tip_index(session: requests.Session, server: str) -> int:
+    # Function fetches the index of the last block in the chain of the node at server
+    blocks = fetch_chain(session, server, {"block_index": -1})
+    return blocks[0]["index"] if blocks else 0
+
+
+def fetch_blocks(session: requests.Session, server: str, start_index: int, end_index: int) -> List[Block]:
+    # Function fetches the blocks from start_index to end_index (inclusive) of the node at server
+    # Batches are requested concurrently and put back in order
+    def fetch_batch(batch_start: int) -> List[dict]:
+        count = min(batch_size, end_index - batch_start + 1)
+        return fetch_chain(session, server, {"start_index": batch_start, "count": count})
+
+    with ThreadPoolExecutor(max_pipelined_batches) as executor:
+        batches = executor.map(fetch_batch, range(start_index, end_index + 1, batch_size))
+        try:
+            return [Block.from_chain_dict(block_dict) for batch in batches for block_dict in batch]
+        except (KeyError, ValueError) as e:
+            raise RuntimeError(f"Peer {server} gave an invalid block: {e}")
+
+
+def check_block(block: Block, previous_block_hash: str) -> str:
+    # Function checks a block fetched from a peer, returns an error message - empty string if the block is valid
+    if block.previous_block_hash != previous_block_hash:
+        return f"Block {block.uuid} does not follow the previous block"
+
+    if not block.is_valid():
+        return f"Block {block.uuid} contains invalid transactions"
+
+    block_hash = block.hash(include_proof_of_work=True, include_miner_key=True)
+    if block.block_hash != block_hash or not block_hash.startswith('0' * crypto.num_of_zeros):
+        return f"Block {block.uuid} does not have a valid proof of work"
+
+    return ""
+
+
+def verify_blocks(blocks: List[Block], tip: Block) -> None:
+    # Function verifies that blocks follow on from tip, throws RuntimeError if they don't
+    # The links between blocks are cheap and worked out in order, the signatures are checked in parallel
+    previous_hashes = [tip.hash()] + [block.hash() for block in blocks[:-1]]
+
+    for expected_index, block in enumerate(blocks, tip.index + 1):
+        if block.index != expected_index:
+            raise RuntimeError(f"Expected block with index {expected_index}, received {block.index}")
+
+    with ThreadPoolExecutor(verify_workers) as executor:
+        for error_msg in executor.map(check_block, blocks, previous_hashes):
+            if error_msg:
+                raise RuntimeError(error_msg)
+
+
+def check_transactions(blocks: List[Block]) -> None:
+    # Function checks that the transactions of blocks can be added to this node's chain, throws RuntimeError if not
+    # A transaction can only be mined once, and a sender can't send more than their balance before the block, as
+    # transactions made on this node are checked. Coinbases give out coins, so their balances aren't checked
+    transaction_uuids = [transaction.uuid for block in blocks for transaction in block.transactions]
+    if len(set(transaction_uuids)) != len(transaction_uuids):
+        raise RuntimeError("Blocks contain the same transaction more than once")
+
+    for i in range(0, len(transaction_uuids), max_query_uuids):
+        mined = Transaction.query.filter(Transaction.uuid.in_(transaction_uuids[i:i + max_query_uuids]),
+                                         Transaction.has_been_mined.is_(True)).first()
+        if mined is not None:
+            raise RuntimeError(f"Transaction {mined.uuid} has already been mined")
+
+    coinbase_keys = {signatures.public_key_to_bytes(coinbase.public_key) for coinbase in CoinBase.query.all()}
+    balances = {}  # balances of keys, by their bytes, as of the block being checked
+
+    def add_to_balance(public_key: signatures.PublicKey, amount: int) -> None:
+        key = signatures.public_key_to_bytes(public_key)
+        if key not in balances:
+            balances[key] = CoinBase.get_key_balance(public_key)
+        balances[key] += amount
+
+    for block in blocks:
+        sent = defaultdict(int)
+        for transaction in block.transactions:
+            sender = signatures.public_key_to_bytes(transaction.sender_public_key)
+            if sender in coinbase_keys:
+                continue
+            add_to_balance(transaction.sender_public_key, 0)
+            sent[sender] += transaction.amount
+            if sent[sender] > balances[sender]:
+                raise RuntimeError(f"Transaction {transaction.uuid} sends more than its sender's balance")
+
+        for transaction in block.transactions:
+            add_to_balance(transaction.sender_public_key, -transaction.amount)
+            add_to_balance(transaction.recipient_public_key, transaction.amount)
+        if block.miner_key is not None:
+            add_to_balance(crypto.ascii_key_to_public_key(block.miner_key), crypto.block_mining_reward)
+
+
+def apply_blocks(blocks: List[Block], block_store: BlockStore) -> None:
+    # Function adds verified blocks to the chain in one transaction
+    # Their transactions may already be stored on this node waiting to be mined, so they are merged
+    # The mining blocks are cleared as they no longer follow the last block
+    block_dicts = [block.to_chain_dict() for block in blocks]
+    Block.query.filter_by(is_mining_block=True).delete()
+    for block, block_dict in zip(blocks, block_dicts):
+        db.session.merge(block)
+        db.session.add_all(AddressHistory.from_block(block_dict))
+    db.session.commit()
+    BlockChain(block_store).sync_block_store()
+
+
+def sync_with_peer(server: str, session: requests.Session, block_store: BlockStore) -> int:
+    # Function adds the blocks this node is missing from the node at server, returns the amount of blocks added
+    # Throws RuntimeError if the peer's blocks are invalid or don't follow this node's chain
+    tip_index = block_store.tip_index()
+    peer_tip_index = fetch_tip_index(session, server)
+    if peer_tip_index <= tip_index:
+        return 0
+
+    blocks = fetch_blocks(session, server, tip_index + 1, peer_tip_index)
+    if len(blocks) == 0:
+        return 0
+
+    tip = Block.query.filter_by(index=tip_index).one()
+    verify_blocks(blocks, tip)
+    check_transactions(blocks)
+    apply_blocks(blocks, block_store)
+    return len(blocks)
+
+
+def sync_with_peers(block_store: BlockStore) -> List[Tuple[str, str]]:
+    # Function syncs this node with each of its peers in turn, returns a (server, message) pair per peer
+    results = []
+    with create_session() as session:
+        for peer in CoinBase.peers():
+            try:
+                num_blocks = sync_with_peer(peer.server, session, block_store)
+                results.append((peer.server, f"Added {num_blocks} blocks"))
+            except (RuntimeError, requests.RequestException) as e:
+                db.session.rollback()
+                results.append((peer.server, str(e)))
+    return results
+
+
+def backfill_with_peer(server: str, session: requests.Session) -> int:
+    # Function adds the blocks before the checkpoint of a node bootstrapped from a snapshot from the node at server,
+    # returns the amount of blocks added. The blocks are verified as synced blocks are, and must lead up to the
+    # checkpoint's tip and match its rolling hash. They are only kept in the database, as a record of the history and
+    # in the address history of their keys
+    # Throws RuntimeError if the peer's blocks are invalid or don't match the checkpoint
+    checkpoint = BlockChain.checkpoint()
+    if checkpoint is None:
+        return 0
+    stored = Block.query.filter(Block.is_mining_block.is_(False), Block.index < checkpoint.index).count()
+    if stored == checkpoint.index:
+        return 0
+
+    genesis = Block.query.filter_by(index=0).one()
+    tip = Block.query.filter_by(index=checkpoint.index).one()
+    blocks = fetch_blocks(session, server, 1, checkpoint.index - 1)
+    verify_blocks(blocks, genesis)
+    if (blocks[-1] if blocks else genesis).hash() != tip.previous_block_hash:
+        raise RuntimeError(f"The history of {server} does not lead to the checkpoint")
+
+    block_hashes = [genesis.block_hash] + [block.block_hash for block in blocks] + [tip.block_hash]
+    if snapshot.chain_digests(block_hashes)[1].hex() != checkpoint.chain_hash:
+        raise RuntimeError(f"The history of {server} does not match the checkpoint's chain hash")
+
+    # Transactions of the history may be stored on this node waiting to be mined, so they are merged
+    for block in blocks:
+        db.session.merge(block)
+        db.session.add_all(AddressHistory.from_block(block.to_chain_dict()))
+    db.session.commit()
+    return len(blocks)
+
+
+def backfill_with_peers() -> Tuple[str, str]:
+    # Function back-fills the history before the checkpoint from the first peer that has it, returns the
+    # (server, message) of that peer, or of the last peer tried
+    result = ("", "No peers to back-fill from")
+    with create_session() as session:
+        for peer in CoinBase.peers():
+            try:
+                num_blocks = backfill_with_peer(peer.server, session)
+                return peer.server, f"Back-filled {num_blocks} blocks"
+            except (RuntimeError, requests.RequestException) as e:
+                db.session.rollback()
+                result = (peer.server, str(e))
+    return result
+
+
+def add_peer(server: str) -> None:
+    # Function stores the coinbase of the node at server as a peer of this node
+    # Throws RuntimeError if the node couldn't be reached
+    try:
+        response = requests.get(f"{server}/api/coinbase", timeout=request_timeout)
+        response.raise_for_status()
+        public_key = crypto.ascii_key_to_public_key(response.json()["public_key"])
+    except (requests.RequestException, KeyError, ValueError) as e:
+        raise RuntimeError(f"Could not get the coinbase of {server}: {e}")
+
+    if any(peer.server == server for peer in CoinBase.peers()):
+        return
+    db.session.add(CoinBase(public_key, None, server))
+    db.session.commit()
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The modules of the coinbase are at the top of the repository rather than in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import coinbase  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    # A node with a new database, inside its app context and set up as on its first request
+    app = coinbase.create_app(f"sqlite:///{tmp_path / 'node.sqlite3'}", crypto_workers=0)
+    with app.app_context():
+        coinbase.init_node()
+        yield app
+        coinbase.db.session.remove()
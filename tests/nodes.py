@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from typing import List
+
+import requests
+
+import blockchain as crypto
+import coinbase
+from blockchain import Block, Transaction, Wallet, db
+
+# Helpers for tests running nodes, either as separate processes on their own ports talked to over HTTP, or in the
+# test's own app context
+
+repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+start_timeout = 30  # seconds
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def app_factory(database_uri: str, port: int) -> str:
+    # Function gives the FLASK_APP of a node, cryptography runs inline as the nodes are small
+    return f"coinbase:create_app({database_uri!r}, {port}, None, 0)"
+
+
+class NodeProcess:
+    """Class represents a node running in its own process, serving on port"""
+
+    def __init__(self, database_uri: str, port: int):
+        self.database_uri = database_uri
+        self.port = port
+        self.server = f"http://127.0.0.1:{port}"
+        script = f"import coinbase; coinbase.create_app({database_uri!r}, {port}, None, 0).run(port={port})"
+        self.process = subprocess.Popen([sys.executable, "-c", script], cwd=repository,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.wait_until_serving()
+
+    def wait_until_serving(self) -> None:
+        deadline = time.monotonic() + start_timeout
+        while True:
+            try:
+                requests.get(f"{self.server}/api/coinbase", timeout=5).raise_for_status()
+                return
+            except requests.RequestException:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"Node on port {self.port} did not start")
+                time.sleep(0.1)
+
+    def get(self, path: str, **params) -> requests.Response:
+        return requests.get(f"{self.server}{path}", params=params, timeout=10)
+
+    def post(self, path: str, json: dict) -> requests.Response:
+        return requests.post(f"{self.server}{path}", json=json, timeout=10)
+
+    def flask(self, *args: str) -> subprocess.CompletedProcess:
+        # Function runs a flask command against this node's database, as done in the README
+        env = dict(os.environ, FLASK_APP=app_factory(self.database_uri, self.port))
+        return subprocess.run([sys.executable, "-m", "flask", *args], cwd=repository, env=env,
+                              capture_output=True, text=True)
+
+    def stop(self) -> None:
+        self.process.terminate()
+        self.process.wait(timeout=10)
+
+
+def solve_proof_of_work(mining_input: str, miner_key: str) -> int:
+    # Function finds a proof of work for a mining block the same way as static/main.js
+    block_bytes = miner_key.encode("ascii") + base64.b64decode(mining_input)
+    proof_of_work = 1
+    while not hashlib.sha256(block_bytes + str(proof_of_work).encode("ascii")).hexdigest() \
+            .startswith("0" * crypto.num_of_zeros):
+        proof_of_work += 1
+    return proof_of_work
+
+
+def mine_block(node: NodeProcess, miner_key: str) -> None:
+    # Function mines one of the node's mining blocks into its chain
+    mining_block = node.get("/api/mine").json()["blocks"][0]
+    response = node.post("/api/mine", {
+        "uuid": mining_block["uuid"],
+        "miner_public_key": miner_key,
+        "proof_of_work": str(solve_proof_of_work(mining_block["block"], miner_key))
+    })
+    assert response.status_code == 200, response.text
+
+
+def signed_transaction(sender: Wallet, recipient: Wallet, amount: int) -> Transaction:
+    transaction = Transaction(sender.public_key, sender.private_key, recipient.public_key, amount, uuid.uuid4())
+    transaction.sign()
+    return transaction
+
+
+def add_block(transactions: List[Transaction], miner: Wallet) -> Block:
+    # Function adds a block of transactions to the chain of the node in the app context, as if it was mined by miner
+    tip = Block.query.filter_by(is_mining_block=False).order_by(Block.index.desc()).first()
+    block = Block(transactions, tip.hash())
+    db.session.add(block)
+    block.miner_key = crypto.public_key_to_ascii_key(miner.public_key)
+    block.proof_of_work = solve_proof_of_work(block.get_mining_input(), block.miner_key)
+    block.block_hash = block.hash(include_proof_of_work=True, include_miner_key=True)
+    coinbase.get_node().blockchain.move_minable_block(block)
+    return block
@@ -0,0 +1,162 @@
+import threading
+import time
+import uuid
+
+import pytest
+
+import blockchain as crypto
+import signatures
+import sync
+from admission import RecentSubmissions, SubmissionQueue
+from blockchain import Block, Wallet, db
+from coinbase import get_node
+from cryptopool import PoolFullError
+from nodes import solve_proof_of_work
+
+
+def test_queue_turns_away_past_max_size():
+    queue = SubmissionQueue(2)
+    checking, release = threading.Event(), threading.Event()
+    results = []
+
+    def submit():
+        with queue.admit() as admitted:
+            results.append(admitted)
+            checking.set()
+            release.wait(5)
+
+    # One submission is being checked and holds the check, the next waits for its turn
+    threads = [threading.Thread(target=submit) for _ in range(2)]
+    threads[0].start()
+    assert checking.wait(5)
+    threads[1].start()
+    deadline = time.monotonic() + 5
+    while queue.size < 2:
+        assert time.monotonic() < deadline, "The second submission was never admitted"
+        time.sleep(0.01)
+
+    with queue.admit() as admitted:
+        assert not admitted
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == [True, True] and queue.size == 0
+
+
+def test_queue_is_released_after_an_error():
+    queue = SubmissionQueue(1)
+    with pytest.raises(RuntimeError):
+        with queue.admit() as admitted:
+            assert admitted
+            raise RuntimeError("check failed")
+
+    assert queue.size == 0
+    with queue.admit() as admitted:
+        assert admitted
+
+
+def test_recent_submissions_are_turned_away():
+    recent = RecentSubmissions(10)
+    assert recent.add(("block", "key", 1))
+    assert not recent.add(("block", "key", 1))
+    assert recent.add(("block", "key", 2))
+
+
+def test_least_recent_submission_is_forgotten():
+    recent = RecentSubmissions(2)
+    assert recent.add(1) and recent.add(2)
+    assert not recent.add(1)  # 1 is now the most recent, so 2 is forgotten first
+    assert recent.add(3)
+    assert recent.add(2)
+    assert not recent.add(3)
+
+
+def test_removed_submission_can_be_sent_again():
+    recent = RecentSubmissions(10)
+    recent.add(1)
+    recent.remove(1)
+    recent.remove(2)
+    assert recent.add(1)
+
+
+@pytest.fixture
+def miner(app):
+    # A node with two mining blocks, and the key of a miner
+    client = app.test_client()
+    buyer = Wallet(scheme=signatures.get_scheme("ed25519"))
+    for _ in range(crypto.BlockChain.max_transactions_const + 1):
+        response = client.post("/api/buy", json={"public_key": crypto.public_key_to_ascii_key(buyer.public_key)})
+        assert response.status_code == 200
+    blocks = client.get("/api/mine").get_json(force=True)["blocks"]
+    assert len(blocks) == 2
+    return client, blocks, crypto.public_key_to_ascii_key(Wallet(scheme=signatures.get_scheme("ed25519")).public_key)
+
+
+def submit(client, mining_block: dict, miner_key: str):
+    return client.post("/api/mine", json={
+        "uuid": mining_block["uuid"],
+        "miner_public_key": miner_key,
+        "proof_of_work": str(solve_proof_of_work(mining_block["block"], miner_key))
+    })
+
+
+def test_proof_turned_away_by_a_full_queue_can_be_sent_again(miner, monkeypatch):
+    client, blocks, miner_key = miner
+    monkeypatch.setattr(get_node().submission_queue, "max_size", 0)
+    response = submit(client, blocks[0], miner_key)
+    assert response.status_code == 429 and response.headers["Retry-After"] == "1"
+
+    monkeypatch.undo()
+    assert submit(client, blocks[0], miner_key).status_code == 200
+    assert submit(client, blocks[0], miner_key).status_code == 409
+
+
+def test_proof_turned_away_by_a_full_pool_can_be_sent_again(miner, monkeypatch):
+    client, blocks, miner_key = miner
+
+    def full(*args):
+        raise PoolFullError("Too many cryptographic operations are waiting, try again later")
+
+    monkeypatch.setattr(get_node().crypto_pool, "verify_many", full)
+    assert submit(client, blocks[0], miner_key).status_code == 503
+
+    monkeypatch.undo()
+    assert submit(client, blocks[0], miner_key).status_code == 200
+
+
+def test_block_on_an_old_tip_is_turned_away(miner):
+    client, blocks, miner_key = miner
+    assert submit(client, blocks[0], miner_key).status_code == 200
+
+    response = submit(client, blocks[1], miner_key)
+    assert response.status_code == 401 and b"no longer valid" in response.data
+
+
+def test_mining_blocks_of_another_process_are_prechecked(miner):
+    client, blocks, miner_key = miner
+    blockchain = crypto.BlockChain()
+    blockchain.load_mining_blocks()
+    assert all(blockchain.precheck_mine_block(uuid.UUID(block["uuid"])) == "" for block in blocks)
+
+    # A block on an old tip, as another process would have left if it stopped before clearing its mining blocks
+    stale_block = Block([], "0" * 64)
+    db.session.add(stale_block)
+    db.session.commit()
+    node = get_node()
+    node.blockchain.loaded_at = 0.0
+    assert "no longer valid" in node.blockchain.precheck_mine_block(stale_block.uuid)
+
+    # Blocks that were never created are left for the database to turn away
+    assert node.blockchain.precheck_mine_block(uuid.uuid4()) == ""
+
+
+def test_mined_block_hashes_the_same_once_stored(miner):
+    client, blocks, miner_key = miner
+    assert submit(client, blocks[0], miner_key.upper()).status_code == 400
+    assert submit(client, blocks[0], miner_key).status_code == 200
+
+    db.session.expire_all()
+    genesis, block_dict = get_node().blockchain.block_store.iter_blocks(0, 1)
+    block = Block.from_chain_dict(block_dict)
+    assert block.ascii_miner_key() == miner_key
+    assert sync.check_block(block, Block.from_chain_dict(genesis).hash()) == ""
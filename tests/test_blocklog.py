@@ -0,0 +1,181 @@
+import os
+
+import pytest
+
+import coinbase
+import signatures
+from blockchain import BlockStore, SQLBlockStore, Wallet
+from nodes import add_block
+from blocklog import BlockLog, index_entry_format, record_length_format
+
+
+def block(index: int) -> dict:
+    # Blocks are stored as given, so any dictionary with an index will do
+    return {"index": index, "hash": f"{index:064x}", "transactions": [{"amount": index}] * (index % 3)}
+
+
+def fill(log: BlockLog, amount: int, start: int = 0) -> None:
+    for index in range(start, start + amount):
+        log.append(block(index))
+
+
+def segments(path) -> list:
+    return sorted(name for name in os.listdir(path) if name.startswith("segment-"))
+
+
+@pytest.fixture
+def log(tmp_path):
+    return BlockLog(str(tmp_path / "blocklog"))
+
+
+def test_empty_log(log):
+    assert log.tip_index() == -1
+    assert log.get_block(0) is None
+    assert list(log.iter_blocks()) == []
+
+
+def test_blocks_are_read_back(log):
+    fill(log, 10)
+    assert log.tip_index() == 9
+    assert log.get_block(4) == block(4)
+    assert log.get_block(10) is None
+    assert list(log.iter_blocks()) == [block(i) for i in range(10)]
+    assert list(log.iter_blocks(3, 6)) == [block(i) for i in range(3, 7)]
+
+
+def test_stored_blocks_are_skipped(log):
+    fill(log, 5)
+    log.append(block(2))
+    with pytest.raises(ValueError, match="conflicts"):
+        log.append({"index": 2, "hash": "other"})
+    assert log.get_block(2) == block(2)
+    assert log.tip_index() == 4
+
+
+def test_blocks_must_follow_on(log):
+    with pytest.raises(ValueError, match="does not follow on"):
+        log.append(block(1))
+    fill(log, 3)
+    with pytest.raises(ValueError, match="does not follow on"):
+        log.append(block(5))
+    assert log.tip_index() == 2
+
+    # Only the tip of a checkpoint may leave a gap, the blocks before it are never added to the log
+    log.append(block(5), is_checkpoint=True)
+    log.append(block(6))
+    with pytest.raises(ValueError, match="conflicts"):
+        log.append(block(4))
+    assert log.get_block(3) is None
+    assert list(log.iter_blocks(1)) == [block(1), block(2), block(5), block(6)]
+
+
+def test_blocks_added_without_the_log_are_filled_in(tmp_path):
+    miner = Wallet(scheme=signatures.get_scheme("ed25519"))
+    app = coinbase.create_app(f"sqlite:///{tmp_path / 'node.sqlite3'}", block_log_path=str(tmp_path / "blocklog"),
+                              crypto_workers=0)
+    with app.app_context():
+        coinbase.init_node()
+        blockchain = coinbase.get_node().blockchain
+        log = blockchain.block_store
+
+        # As flask sync does when it's run without the node's block log
+        blockchain.block_store = SQLBlockStore()
+        add_block([], miner)
+        blockchain.block_store = log
+        assert log.tip_index() == 0
+
+        add_block([], miner)
+        assert [block_dict["index"] for block_dict in log.iter_blocks()] == [0, 1, 2]
+        coinbase.db.session.remove()
+
+
+def test_segments_roll_over(tmp_path):
+    path = str(tmp_path / "blocklog")
+    log = BlockLog(path, max_segment_size=256)
+    fill(log, 30)
+    assert len(segments(path)) > 3
+    for name in segments(path):
+        assert os.path.getsize(os.path.join(path, name)) <= 256
+
+    assert list(log.iter_blocks()) == [block(i) for i in range(30)]
+    assert list(log.iter_blocks(17, 25)) == [block(i) for i in range(17, 26)]
+    assert all(log.get_block(i) == block(i) for i in range(30))
+
+
+def test_record_larger_than_a_segment(tmp_path):
+    log = BlockLog(str(tmp_path / "blocklog"), max_segment_size=64)
+    fill(log, 5)
+    assert list(log.iter_blocks()) == [block(i) for i in range(5)]
+
+
+def test_log_is_reopened(tmp_path):
+    path = str(tmp_path / "blocklog")
+    fill(BlockLog(path, max_segment_size=256), 12)
+    log = BlockLog(path, max_segment_size=256)
+    fill(log, 3, 12)
+    assert list(log.iter_blocks()) == [block(i) for i in range(15)]
+
+
+@pytest.mark.parametrize("torn_bytes", [b"\x00\x00", b"\x00\x00\x01\x00\x00\x00{\"ind"])
+def test_torn_segment_write_is_recovered(tmp_path, torn_bytes):
+    path = str(tmp_path / "blocklog")
+    fill(BlockLog(path), 3)
+    segment_path = os.path.join(path, segments(path)[-1])
+    size = os.path.getsize(segment_path)
+    with open(segment_path, "ab") as segment_file:
+        segment_file.write(torn_bytes)
+
+    log = BlockLog(path)
+    assert list(log.iter_blocks()) == [block(i) for i in range(3)]
+    fill(log, 2, 3)
+    assert list(log.iter_blocks()) == [block(i) for i in range(5)]
+    assert os.path.getsize(segment_path) > size
+
+
+@pytest.mark.parametrize("torn_size", [1, 2, index_entry_format.size - 1])
+def test_torn_index_write_is_recovered(tmp_path, torn_size):
+    path = str(tmp_path / "blocklog")
+    fill(BlockLog(path), 3)
+
+    # The crash came after the record was written, part way through writing its index entry
+    segment_path = os.path.join(path, segments(path)[-1])
+    offset = os.path.getsize(segment_path)
+    with open(segment_path, "ab") as segment_file:
+        record = b'{"index": 3}'
+        segment_file.write(record_length_format.pack(len(record)) + record)
+    with open(os.path.join(path, "index"), "ab") as index_file:
+        index_file.write(index_entry_format.pack(3, 0, offset)[:torn_size])
+
+    log = BlockLog(path)
+    assert log.tip_index() == 2
+    assert list(log.iter_blocks()) == [block(i) for i in range(3)]
+
+    fill(log, 2, 3)
+    assert log.tip_index() == 4
+    assert log.get_block(3) == block(3)
+    assert list(log.iter_blocks()) == [block(i) for i in range(5)]
+    assert os.path.getsize(os.path.join(path, "index")) == 5 * index_entry_format.size
+
+
+def test_torn_write_into_a_new_segment_is_recovered(tmp_path):
+    path = str(tmp_path / "blocklog")
+    log = BlockLog(path, max_segment_size=256)
+    fill(log, 6)
+    last_segment = len(segments(path)) - 1
+
+    # A record that was being written into the next segment when the crash came
+    with open(log.segment_path(last_segment + 1), "wb") as segment_file:
+        segment_file.write(b"\x00\x00\x00\x30{\"index\": 6")
+
+    log = BlockLog(path, max_segment_size=256)
+    fill(log, 10, 6)
+    assert list(log.iter_blocks()) == [block(i) for i in range(16)]
+
+
+def test_incomplete_block_store_cannot_be_created():
+    class AppendOnlyStore(BlockStore):
+        def append(self, block_dict):
+            pass
+
+    with pytest.raises(TypeError):
+        AppendOnlyStore()
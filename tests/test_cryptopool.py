@@ -0,0 +1,62 @@
+import time
+
+import pytest
+
+import signatures
+from cryptopool import CryptoPool, PoolFullError, PoolTimeoutError
+
+
+def signed_messages(amount: int) -> list:
+    # (public key, signature, message) of amount messages, the last with a signature of another message
+    private_key = signatures.get_scheme("ed25519").generate_private_key()
+    signed = [(private_key.public_key(), signatures.sign(private_key, b"message %d" % i), b"message %d" % i)
+              for i in range(amount)]
+    public_key, signature, _ = signed[-1]
+    signed[-1] = (public_key, signature, b"other message")
+    return signed
+
+
+@pytest.fixture
+def pool():
+    pools = []
+
+    def make_pool(**kwargs) -> CryptoPool:
+        pools.append(CryptoPool(**kwargs))
+        return pools[-1]
+
+    yield make_pool
+    for crypto_pool in pools:
+        if crypto_pool.executor is not None:
+            crypto_pool.executor.shutdown(cancel_futures=True)
+
+
+@pytest.mark.parametrize("max_workers", [0, 2])
+def test_verify_many(pool, max_workers):
+    crypto_pool = pool(max_workers=max_workers)
+    signed = signed_messages(5)
+    assert crypto_pool.verify_many(signed) == [True] * 4 + [False]
+    assert crypto_pool.verify_many(signed) == signatures.verify_many(signed)
+    assert crypto_pool.verify_many([]) == []
+
+
+def test_tasks_are_submitted_together(pool):
+    crypto_pool = pool(max_workers=2)
+    crypto_pool.verify_many(signed_messages(5))
+    metrics = crypto_pool.metrics()
+    assert metrics["submitted"] == 5 and metrics["rejected"] == 0
+
+
+def test_batch_larger_than_the_free_places_is_turned_away(pool):
+    crypto_pool = pool(max_workers=1, max_pending=4)
+    with pytest.raises(PoolFullError):
+        crypto_pool.verify_many(signed_messages(5))
+    assert crypto_pool.metrics()["pending"] == 0 and crypto_pool.metrics()["rejected"] == 1
+    assert crypto_pool.verify_many(signed_messages(4)) == [True] * 3 + [False]
+
+
+def test_timeout_is_a_pool_error(pool):
+    crypto_pool = pool(max_workers=1, timeout=0.2)
+    with pytest.raises(PoolTimeoutError) as error:
+        crypto_pool.run_many(time.sleep, [(1,), (1,)])
+    assert not isinstance(error.value, TimeoutError)
+    assert crypto_pool.metrics()["timed_out"] == 2
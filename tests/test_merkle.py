@@ -0,0 +1,69 @@
+import hashlib
+import sqlite3
+
+import pytest
+
+import coinbase
+from blockchain import merkle_parent, merkle_path, merkle_root, verify_merkle_path
+
+
+def leaves(amount: int) -> list:
+    return [hashlib.sha256(str(i).encode("ascii")).hexdigest() for i in range(amount)]
+
+
+def test_empty_root_is_hash_of_nothing():
+    assert merkle_root([]) == hashlib.sha256(b"").hexdigest()
+
+
+def test_single_leaf_is_its_own_root():
+    hashes = leaves(1)
+    assert merkle_root(hashes) == hashes[0]
+    assert merkle_path(hashes, 0) == []
+    assert verify_merkle_path(hashes[0], [], hashes[0])
+
+
+def test_odd_level_pairs_last_node_with_itself():
+    a, b, c = leaves(3)
+    assert merkle_root([a, b, c]) == merkle_parent(merkle_parent(a, b), merkle_parent(c, c))
+
+
+@pytest.mark.parametrize("amount", [2, 3, 4, 5, 6, 7, 8, 9, 17])
+def test_every_leaf_has_a_valid_path(amount):
+    hashes = leaves(amount)
+    root = merkle_root(hashes)
+    for index, leaf in enumerate(hashes):
+        path = merkle_path(hashes, index)
+        assert verify_merkle_path(leaf, path, root)
+
+
+@pytest.mark.parametrize("amount", [3, 5, 8])
+def test_path_does_not_prove_other_leaves(amount):
+    hashes = leaves(amount)
+    root = merkle_root(hashes)
+    path = merkle_path(hashes, 0)
+    assert not verify_merkle_path(hashes[1], path, root)
+    assert not verify_merkle_path(hashlib.sha256(b"other").hexdigest(), path, root)
+
+
+def test_tampered_path_is_rejected():
+    hashes = leaves(5)
+    root = merkle_root(hashes)
+    path = merkle_path(hashes, 1)
+    sibling, side = path[1]
+    path[1] = (sibling, "left" if side == "right" else "right")
+    assert not verify_merkle_path(hashes[1], path, root)
+
+
+def test_database_from_before_merkle_roots_is_refused(tmp_path):
+    # A block table as made by versions before blocks stored their merkle root
+    path = tmp_path / "old.sqlite3"
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE block (uuid CHAR(32) PRIMARY KEY, \"index\" INTEGER, "
+                           "previous_block_hash VARCHAR(64))")
+    connection.close()
+
+    app = coinbase.create_app(f"sqlite:///{path}", crypto_workers=0)
+    with app.app_context():
+        with pytest.raises(RuntimeError, match="block.merkle_root"):
+            coinbase.init_node()
+        coinbase.db.session.remove()
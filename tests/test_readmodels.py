@@ -0,0 +1,37 @@
+import pytest
+
+import signatures
+from blockchain import Block, BlockFormat, BlockView, TransactionView, Wallet, get_block_view, iter_block_views
+from coinbase import get_node
+from nodes import add_block, signed_transaction
+
+
+def test_views_match_the_models(app):
+    server = Wallet(False)
+    server.private_key, server.public_key = get_node().coinbase.private_key, get_node().coinbase.public_key
+    alice, miner = Wallet(scheme=signatures.get_scheme("ed25519")), Wallet()
+    add_block([signed_transaction(server, alice, 5), signed_transaction(server, miner, 2)], miner)
+    add_block([signed_transaction(alice, miner, 1)], alice)
+
+    blocks = Block.query.filter_by(is_mining_block=False).order_by(Block.index).all()
+    views = list(iter_block_views(batch_size=2))
+    assert [view.to_chain_dict() for view in views] == [block.to_chain_dict() for block in blocks]
+    assert [view.hash() for view in views] == [block.hash() for block in blocks]
+    assert views[1].compute_merkle_root() == blocks[1].merkle_root
+    assert get_block_view(2).to_chain_dict() == blocks[2].to_chain_dict()
+    assert get_block_view(3) is None
+
+
+def test_views_have_no_instance_dict(app):
+    view = get_block_view(0)
+    assert isinstance(view, BlockView)
+    assert not hasattr(view, "__dict__")
+    assert not hasattr(TransactionView("", b"", b"", 0, b"", ""), "__dict__")
+
+
+def test_incomplete_format_cannot_be_created():
+    class BlockWithoutMinerKey(BlockFormat):
+        __slots__ = ()
+
+    with pytest.raises(TypeError):
+        BlockWithoutMinerKey()
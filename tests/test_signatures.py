@@ -0,0 +1,32 @@
+import pytest
+
+import signatures
+
+
+@pytest.mark.parametrize("name", ["rsa", "ed25519"])
+def test_keys_round_trip_and_sign(name):
+    scheme = signatures.get_scheme(name)
+    private_key = scheme.generate_private_key()
+    public_key = signatures.load_public_key(signatures.public_key_to_bytes(private_key.public_key()))
+    private_key = signatures.load_private_key(signatures.private_key_to_bytes(private_key))
+
+    assert signatures.scheme_of(public_key) is scheme
+    signature = signatures.sign(private_key, b"message")
+    assert signatures.verify(public_key, signature, b"message")
+    assert not signatures.verify(public_key, signature, b"other message")
+
+
+def test_unknown_scheme():
+    with pytest.raises(ValueError):
+        signatures.get_scheme("dsa")
+
+
+def test_incomplete_scheme_cannot_be_created():
+    class SignOnlyScheme(signatures.SignatureScheme):
+        name = "sign-only"
+
+        def sign(self, private_key, message):
+            return b""
+
+    with pytest.raises(TypeError):
+        SignOnlyScheme()
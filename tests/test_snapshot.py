@@ -0,0 +1,237 @@
+import hashlib
+import os
+from contextlib import contextmanager
+
+import pytest
+
+import coinbase
+import signatures
+import snapshot
+import sync
+from blockchain import AddressHistory, Block, CheckpointBalance, CoinBase, Wallet, db
+from coinbase import get_node
+from nodes import NodeProcess, add_block, free_port, mine_block, signed_transaction
+
+
+def wallet() -> Wallet:
+    return Wallet(scheme=signatures.get_scheme("ed25519"))
+
+
+@contextmanager
+def other_node(database_uri: str):
+    # Runs the body in the app context of another node, the session is bound to an app so it's started anew
+    db.session.remove()
+    app = coinbase.create_app(database_uri, crypto_workers=0)
+    try:
+        with app.app_context():
+            coinbase.init_node()
+            yield app
+            db.session.remove()
+    finally:
+        db.session.remove()
+
+
+@pytest.fixture
+def chain(app):
+    # The wallets of a chain of a few blocks
+    server = Wallet(False)
+    server.private_key, server.public_key = get_node().coinbase.private_key, get_node().coinbase.public_key
+    alice, bob, miner = wallet(), wallet(), wallet()
+    add_block([signed_transaction(server, alice, 30)], miner)
+    add_block([signed_transaction(alice, bob, 12), signed_transaction(server, bob, 3)], miner)
+    add_block([signed_transaction(bob, miner, 5)], alice)
+    return [server, alice, bob, miner]
+
+
+def backfill(monkeypatch, block_dicts: list) -> None:
+    # Back-fills the node in the app context from the blocks of another node, as if they were fetched from a peer
+    def fetch_blocks(session, server, start_index, end_index):
+        return [Block.from_chain_dict(block_dict) for block_dict in block_dicts
+                if start_index <= block_dict["index"] <= end_index]
+
+    monkeypatch.setattr(sync, "fetch_blocks", fetch_blocks)
+    sync.backfill_with_peer("peer", None)
+
+
+def rewrite(path: str, offset: int, data: bytes) -> None:
+    # Overwrites part of a snapshot and fixes up its checksum, so only the checks past the checksum can catch it
+    with open(path, "rb") as file:
+        contents = bytearray(file.read())
+    contents[offset:offset + len(data)] = data
+    body = contents[:-snapshot.checksum_size]
+    with open(path, "wb") as file:
+        file.write(body + hashlib.sha256(body).digest())
+
+
+def test_round_trip(chain, tmp_path):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    balances = [CoinBase.get_key_balance(key.public_key) for key in chain]
+
+    tip_index, digest, previous_digest, tip, snapshot_balances = snapshot.read_snapshot(path)
+    assert tip_index == 3 and tip.index == 3
+    assert snapshot_balances[signatures.public_key_to_bytes(chain[1].public_key)] == balances[1]
+    assert snapshot.verify_snapshot(path, get_node().blockchain.block_store) == ""
+
+    with other_node(f"sqlite:///{tmp_path / 'new.sqlite3'}"):
+        snapshot.import_snapshot(path, get_node().blockchain.block_store)
+        assert [CoinBase.get_key_balance(key.public_key) for key in chain[1:]] == balances[1:]
+        assert get_node().blockchain.block_store.tip_index() == 3
+
+        # Without the history before the tip there is nothing to verify the snapshot with
+        with pytest.raises(ValueError, match="Block 1 is missing"):
+            snapshot.verify_snapshot(path, get_node().blockchain.block_store)
+
+
+def test_other_chain_does_not_verify(chain, tmp_path):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    add_block([], chain[3])
+    other_path = str(tmp_path / "other.snapshot")
+    snapshot.export_snapshot(other_path, get_node().blockchain.block_store)
+
+    with other_node(f"sqlite:///{tmp_path / 'other.sqlite3'}"):
+        add_block([], wallet())
+        add_block([], wallet())
+        add_block([], wallet())
+        assert "does not match" in snapshot.verify_snapshot(path, get_node().blockchain.block_store)
+        with pytest.raises(ValueError, match="Block 4 is missing"):
+            snapshot.verify_snapshot(other_path, get_node().blockchain.block_store)
+
+
+@pytest.mark.parametrize("offset", [0, 20, -1, -40])
+def test_corruption_is_rejected(chain, tmp_path, offset):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    with open(path, "r+b") as file:
+        file.seek(offset, os.SEEK_SET if offset >= 0 else os.SEEK_END)
+        byte = file.read(1)
+        file.seek(-1, os.SEEK_CUR)
+        file.write(bytes([byte[0] ^ 0xff]))
+
+    with pytest.raises(ValueError, match="checksum"):
+        snapshot.read_snapshot(path)
+
+
+def test_truncated_snapshot_is_rejected(chain, tmp_path):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    with open(path, "r+b") as file:
+        file.truncate(snapshot.header_format.size)
+
+    with pytest.raises(ValueError):
+        snapshot.read_snapshot(path)
+
+
+def test_tip_index_not_matching_tip_is_rejected(chain, tmp_path):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    rewrite(path, 8, (2).to_bytes(8, "big"))
+
+    with pytest.raises(ValueError, match="expected 2"):
+        snapshot.read_snapshot(path)
+
+
+@pytest.mark.parametrize("digest_offset", [16, 48])
+def test_chain_hash_not_matching_tip_is_rejected(chain, tmp_path, digest_offset):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    rewrite(path, digest_offset, hashlib.sha256(b"other chain").digest())
+
+    with pytest.raises(ValueError, match="not the last block of its chain hash"):
+        snapshot.read_snapshot(path)
+
+
+def test_edited_balance_is_rejected(chain, tmp_path, monkeypatch):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    rewrite(path, -snapshot.checksum_size - snapshot.balance_format.size, snapshot.balance_format.pack(1000))
+    block_dicts = list(get_node().blockchain.block_store.iter_blocks())
+
+    # The checksum can't catch this, only the history can
+    assert "balances of the snapshot" in snapshot.verify_snapshot(path, get_node().blockchain.block_store)
+    with other_node(f"sqlite:///{tmp_path / 'new.sqlite3'}"):
+        snapshot.import_snapshot(path, get_node().blockchain.block_store)
+        backfill(monkeypatch, block_dicts)
+        assert "balances of the snapshot" in snapshot.verify_snapshot(path, get_node().blockchain.block_store)
+
+
+def test_edited_checkpoint_balance_is_rejected(chain, tmp_path, monkeypatch):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    block_dicts = list(get_node().blockchain.block_store.iter_blocks())
+
+    with other_node(f"sqlite:///{tmp_path / 'new.sqlite3'}"):
+        snapshot.import_snapshot(path, get_node().blockchain.block_store)
+        backfill(monkeypatch, block_dicts)
+        assert snapshot.verify_snapshot(path, get_node().blockchain.block_store) == ""
+
+        CheckpointBalance.query.filter_by(public_key=chain[2].public_key).one().balance += 1
+        db.session.commit()
+        assert "bootstrapped with" in snapshot.verify_snapshot(path, get_node().blockchain.block_store)
+
+
+def test_backfilled_blocks_are_in_the_address_history(chain, tmp_path, monkeypatch):
+    path = str(tmp_path / "chain.snapshot")
+    snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    block_dicts = list(get_node().blockchain.block_store.iter_blocks())
+    alice = chain[1].public_key
+    history = [entry.to_ascii_dict() for entry in AddressHistory.page(alice, None, 10)]
+
+    with other_node(f"sqlite:///{tmp_path / 'new.sqlite3'}"):
+        snapshot.import_snapshot(path, get_node().blockchain.block_store)
+        assert [entry.block_index for entry in AddressHistory.page(alice, None, 10)] == [3]
+        backfill(monkeypatch, block_dicts)
+
+        # The back-filled blocks are older than the checkpoint's tip, though their entries were added after it
+        assert [entry.to_ascii_dict() for entry in AddressHistory.page(alice, None, 10)] == history
+        cursor, paged = None, []
+        for _ in range(len(history)):
+            entry, = AddressHistory.page(alice, cursor, 1)
+            paged.append(entry.to_ascii_dict())
+            cursor = entry.id
+        assert paged == history and [entry["block_index"] for entry in history] == [3, 2, 1]
+        assert AddressHistory.page(alice, cursor, 1) == []
+
+
+def test_failed_export_leaves_no_files(chain, tmp_path, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(snapshot, "current_chain_digests", fail)
+    path = str(tmp_path / "chain.snapshot")
+    with pytest.raises(OSError):
+        snapshot.export_snapshot(path, get_node().blockchain.block_store)
+    assert os.listdir(tmp_path) == ["node.sqlite3"]
+
+
+def test_bootstrapped_node_backfills_and_verifies_history(tmp_path):
+    path = str(tmp_path / "chain.snapshot")
+    node = NodeProcess(f"sqlite:///{tmp_path / 'node1.sqlite3'}", free_port())
+    new_node = NodeProcess(f"sqlite:///{tmp_path / 'node2.sqlite3'}", free_port())
+    try:
+        alice = node.get("/api/wallet", scheme="ed25519").json()
+        miner = node.get("/api/wallet", scheme="ed25519").json()
+        for _ in range(3):
+            node.post("/api/buy", {"public_key": alice["public_key"], "amount": 4})
+            mine_block(node, miner["public_key"])
+        assert node.flask("export-snapshot", path).returncode == 0
+
+        result = new_node.flask("import-snapshot", path)
+        assert result.returncode == 0, result.stderr
+        assert new_node.get("/api/wallet/balance", public_key=alice["public_key"]).text == "12"
+        result = new_node.flask("verify-snapshot", path)
+        assert result.returncode != 0 and "back-fill" in result.stderr
+
+        assert new_node.flask("add-peer", node.server).returncode == 0
+        result = new_node.flask("backfill")
+        assert f"{node.server}: Back-filled 2 blocks" in result.stdout, result.stderr
+        result = new_node.flask("verify-snapshot", path)
+        assert result.returncode == 0, result.stderr
+
+        # The history is only kept as a record, balances still start from the checkpoint
+        assert new_node.get("/api/wallet/balance", public_key=alice["public_key"]).text == "12"
+        assert new_node.flask("backfill").stdout.strip() == f"{node.server}: Back-filled 0 blocks"
+    finally:
+        node.stop()
+        new_node.stop()
@@ -0,0 +1,44 @@
+import pytest
+
+from nodes import NodeProcess, free_port, mine_block
+
+
+@pytest.fixture
+def two_nodes(tmp_path):
+    nodes = []
+    try:
+        for name in ["node1", "node2"]:
+            nodes.append(NodeProcess(f"sqlite:///{tmp_path / name}.sqlite3", free_port()))
+        yield nodes
+    finally:
+        for node in nodes:
+            node.stop()
+
+
+def test_genesis_block_is_the_same_on_every_node(two_nodes):
+    node1, node2 = two_nodes
+    assert node1.get("/api/chain").json()["blocks"] == node2.get("/api/chain").json()["blocks"]
+
+
+def test_node_syncs_blocks_mined_on_its_peer(two_nodes):
+    node1, node2 = two_nodes
+    wallet = node1.get("/api/wallet", scheme="ed25519").json()
+    miner = node1.get("/api/wallet", scheme="ed25519").json()
+    for amount in [5, 7, 11, 13]:
+        assert node1.post("/api/buy", {"public_key": wallet["public_key"], "amount": amount}).status_code == 200
+    mine_block(node1, miner["public_key"])
+    mine_block(node1, miner["public_key"])
+
+    result = node2.flask("add-peer", node1.server)
+    assert result.returncode == 0, result.stderr
+    result = node2.flask("sync")
+    assert result.returncode == 0, result.stderr
+    assert f"{node1.server}: Added 2 blocks" in result.stdout
+
+    assert node2.get("/api/chain").json() == node1.get("/api/chain").json()
+    assert node2.get("/api/wallet/balance", public_key=wallet["public_key"]).text == "36"
+    assert node2.get("/api/wallet/balance", public_key=miner["public_key"]).text == "40"
+
+    # Nothing is left to sync
+    result = node2.flask("sync")
+    assert f"{node1.server}: Added 0 blocks" in result.stdout
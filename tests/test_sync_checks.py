@@ -0,0 +1,83 @@
+import pytest
+
+import signatures
+import sync
+from blockchain import Block, CoinBase, Transaction, Wallet
+from coinbase import get_node
+from nodes import add_block, signed_transaction
+
+
+def wallet() -> Wallet:
+    return Wallet(scheme=signatures.get_scheme("ed25519"))
+
+
+def coinbase_wallet() -> Wallet:
+    coinbase = get_node().coinbase
+    server_wallet = Wallet(False)
+    server_wallet.private_key, server_wallet.public_key = coinbase.private_key, coinbase.public_key
+    return server_wallet
+
+
+def peer_block(transactions, previous_block: Block, miner: Wallet) -> Block:
+    # A block as it would be fetched from a peer, following previous_block
+    block = Block(transactions, previous_block.hash())
+    block.index = previous_block.index + 1
+    block.miner_key = signatures.public_key_to_bytes(miner.public_key).hex()
+    block.is_mining_block = False
+    return block
+
+
+def copy_transaction(transaction: Transaction) -> Transaction:
+    copy = Transaction(transaction.sender_public_key, None, transaction.recipient_public_key, transaction.amount,
+                       transaction.uuid)
+    copy.signature = transaction.signature
+    return copy
+
+
+def test_transactions_from_coinbases_and_funded_senders_are_accepted(app):
+    alice, bob, miner = wallet(), wallet(), wallet()
+    tip = add_block([signed_transaction(coinbase_wallet(), alice, 10)], miner)
+
+    first = peer_block([signed_transaction(alice, bob, 6), signed_transaction(alice, bob, 4)], tip, miner)
+    second = peer_block([signed_transaction(bob, alice, 10), signed_transaction(miner, alice, 40)], first, miner)
+    sync.check_transactions([first, second])
+
+
+def test_transaction_mined_locally_is_rejected(app):
+    alice, bob, miner = wallet(), wallet(), wallet()
+    funding = signed_transaction(coinbase_wallet(), alice, 10)
+    tip = add_block([funding], miner)
+
+    block = peer_block([copy_transaction(funding)], tip, miner)
+    with pytest.raises(RuntimeError, match="already been mined"):
+        sync.check_transactions([block])
+
+
+def test_transaction_repeated_across_blocks_is_rejected(app):
+    alice, bob, miner = wallet(), wallet(), wallet()
+    tip = add_block([signed_transaction(coinbase_wallet(), alice, 10)], miner)
+
+    payment = signed_transaction(alice, bob, 1)
+    first = peer_block([payment], tip, miner)
+    second = peer_block([copy_transaction(payment)], first, miner)
+    with pytest.raises(RuntimeError, match="more than once"):
+        sync.check_transactions([first, second])
+
+
+def test_sender_without_balance_is_rejected(app):
+    alice, bob, miner = wallet(), wallet(), wallet()
+    tip = add_block([signed_transaction(coinbase_wallet(), alice, 10)], miner)
+
+    block = peer_block([signed_transaction(alice, bob, 6), signed_transaction(alice, bob, 5)], tip, miner)
+    with pytest.raises(RuntimeError, match="more than its sender's balance"):
+        sync.check_transactions([block])
+
+
+def test_coins_received_in_the_same_block_cannot_be_spent(app):
+    alice, bob, miner = wallet(), wallet(), wallet()
+    tip = add_block([signed_transaction(coinbase_wallet(), alice, 10)], miner)
+
+    block = peer_block([signed_transaction(alice, bob, 10), signed_transaction(bob, alice, 10)], tip, miner)
+    with pytest.raises(RuntimeError, match="more than its sender's balance"):
+        sync.check_transactions([block])
+    assert CoinBase.get_key_balance(bob.public_key) == 0